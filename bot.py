@@ -3,38 +3,88 @@
 import os
 import sys
 import logging
-from datetime import datetime
-from typing import Dict, List
+import time
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
 import asyncio
 
 # Add src directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from telegram import Update, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
-from telegram.ext import Application, InlineQueryHandler, ContextTypes
+from telegram import (
+    Update, InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
+    InlineKeyboardButton, InlineKeyboardMarkup
+)
+from telegram.ext import Application, InlineQueryHandler, ChosenInlineResultHandler, ContextTypes
 from telegram.constants import ParseMode
 from dotenv import load_dotenv
-import uuid
 
 from database import DatabaseManager
-from ai_service import AIService
+from coordination import create_coordinator
+from resilience import CircuitBreaker, CircuitOpenError, HedgePolicy
+from ai_service import AIService, VARIANT_TONES
+from backend_pool import Backend, BackendPool, parse_backends
+from message_cache import MessageCache, Variant, normalize_topic
+from coalescer import RequestCoalescer
+from debounce import AdaptiveDebouncer
+from scheduler import FairScheduler, GenerationSlots, RateLimitExceeded, DeadlineExceeded
 from whitelist import WhitelistManager
+from topic_filter import TopicFilter
+from metrics import metrics
+from logging_setup import setup_logging
+from streaming import StreamingMessageEditor
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO')),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.getenv('LOG_FILE', './logs/bot.log')),
-        logging.StreamHandler(sys.stdout)
-    ]
+# Configure logging (written from a background thread, off the event loop)
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    log_file=os.getenv('LOG_FILE', './logs/bot.log'),
+    log_format=os.getenv('LOG_FORMAT', 'json').lower(),
+    max_bytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backup_count=int(os.getenv('LOG_BACKUP_COUNT', 5)),
+    rotate_when=os.getenv('LOG_ROTATE_WHEN', ''),
+    sample_rate=float(os.getenv('LOG_KEYSTROKE_SAMPLE_RATE', 1.0))
 )
 
 logger = logging.getLogger(__name__)
 
+# Time kept free before Telegram's inline deadline to send the answer itself
+ANSWER_MARGIN_SECONDS = 0.5
+
+# How often to check on a topic another bot process is generating
+PEER_GENERATION_POLL_SECONDS = 0.25
+
+# Result IDs of streaming placeholders, told apart when a result is chosen
+STREAM_RESULT_PREFIX = 'stream-'
+
+# Scheduler identity of background pre-generation (Telegram user IDs are positive)
+PREGENERATION_USER_ID = 0
+
+# Suggestions shown for an empty query, per kind
+SUGGESTED_RECENT_TOPICS = 5
+SUGGESTED_TRENDING_TOPICS = 5
+
+# Seconds Telegram may answer a repeated query from its own cache, by outcome.
+# Generated messages ('generated', 'cache_hit') follow MESSAGE_CACHE_TTL_SECONDS.
+ANSWER_CACHE_TIMES = {
+    # Short: the next empty query may have suggestions to show
+    'help': 60,
+    'suggestions': 30,
+    'streaming': 30,
+    'denied': 300,
+    'inappropriate': 300,
+    'rate_limited': 60,
+    'stale': 30,
+    'unavailable': 30,
+    'failed': 30,
+    'error': 10,
+    'deadline': 10,
+    'busy': 5,
+}
+
 class VibeMessageBot:
     def __init__(self):
         # Load configuration
@@ -47,230 +97,943 @@ class VibeMessageBot:
         self.api_requests_per_minute = int(os.getenv('API_REQUESTS_PER_MINUTE', 10))
         self.api_requests_per_day = int(os.getenv('API_REQUESTS_PER_DAY', 1000))
         
+        # Pool of (API key, model) backends; defaults to the single key/model above
+        self.ai_backends = parse_backends(
+            os.getenv('GOOGLE_AI_BACKENDS', ''), self.google_ai_key, self.model_name,
+            self.api_requests_per_minute, self.api_requests_per_day
+        )
+        self.ai_backend_failure_threshold = int(os.getenv('AI_BACKEND_FAILURE_THRESHOLD', 3))
+        self.ai_backend_cooldown = float(os.getenv('AI_BACKEND_COOLDOWN_SECONDS', 60))
+        
+        # Hedging: resend calls slower than the observed latency quantile, within a budget
+        self.ai_hedge_enabled = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+        self.ai_hedge_quantile = float(os.getenv('AI_HEDGE_QUANTILE', 0.95))
+        self.ai_hedge_max_ratio = float(os.getenv('AI_HEDGE_MAX_RATIO', 0.1))
+        
+        # Fair scheduling of the API quota across users
+        self.user_daily_soft_cap = int(os.getenv('USER_DAILY_SOFT_CAP', 50))
+        self.user_over_cap_weight = float(os.getenv('USER_OVER_CAP_WEIGHT', 0.25))
+        
+        # Time Telegram gives us to answer an inline query
+        self.inline_query_timeout = float(os.getenv('INLINE_QUERY_TIMEOUT_SECONDS', 10.0))
+        
+        # Load shedding: beyond these limits queries get an immediate "busy" answer
+        self.max_inflight_generations = int(os.getenv('MAX_INFLIGHT_GENERATIONS', 16))
+        self.max_pending_queries = int(os.getenv('MAX_PENDING_QUERIES', 1000))
+        
+        # Generation concurrency and timeout
+        self.ai_max_concurrent_requests = int(os.getenv('AI_MAX_CONCURRENT_REQUESTS', 4))
+        # Below INLINE_QUERY_TIMEOUT_SECONDS minus DEBOUNCE_DELAY_SECONDS, so a
+        # call that times out still leaves time to answer
+        self.ai_request_timeout = float(os.getenv('AI_REQUEST_TIMEOUT_SECONDS', 7.0))
+        
         # Message configuration
         self.min_message_length = int(os.getenv('MIN_MESSAGE_LENGTH', 300))
         self.max_message_length = int(os.getenv('MAX_MESSAGE_LENGTH', 400))
         
+        # Number of variants generated per request (1 = single message)
+        self.message_variants = max(1, min(int(os.getenv('MESSAGE_VARIANTS', 1)), len(VARIANT_TONES)))
+        
         # Debouncing configuration
         self.debounce_delay = float(os.getenv('DEBOUNCE_DELAY_SECONDS', 2.0))
         self.pending_queries = {}  # Store pending queries for debouncing
         
+        # Adapt the delay to each user's typing rhythm, between the minimum and DEBOUNCE_DELAY_SECONDS
+        self.debounce_adaptive = os.getenv('DEBOUNCE_ADAPTIVE', 'true').lower() == 'true'
+        self.debounce_min_delay = float(os.getenv('DEBOUNCE_MIN_DELAY_SECONDS', 0.3))
+        self.debounce_max_users = int(os.getenv('DEBOUNCE_MAX_TRACKED_USERS', 10000))
+        
         # Debouncing configuration
         self.debounce_delay = float(os.getenv('DEBOUNCE_DELAY_SECONDS', 2.0))
         
+        # Message cache configuration
+        self.message_cache_enabled = os.getenv('MESSAGE_CACHE_ENABLED', 'true').lower() == 'true'
+        self.message_cache_ttl = float(os.getenv('MESSAGE_CACHE_TTL_SECONDS', 86400))
+        self.message_cache_max_entries = int(os.getenv('MESSAGE_CACHE_MAX_ENTRIES', 1000))
+        self.message_cache_max_db_entries = int(os.getenv('MESSAGE_CACHE_MAX_DB_ENTRIES', 10000))
+        # Reuse the messages of a near-duplicate topic ("benefits of IPv6" for "ipv6 benefits")
+        self.message_cache_similarity_enabled = os.getenv('MESSAGE_CACHE_SIMILARITY_ENABLED', 'true').lower() == 'true'
+        self.message_cache_similarity_threshold = float(os.getenv('MESSAGE_CACHE_SIMILARITY_THRESHOLD', 0.8))
+        
+        # Generated answers stay valid as long as the message cache would serve them
+        generated_cache_time = int(self.message_cache_ttl) if self.message_cache_enabled else 30
+        self.answer_cache_times = {**ANSWER_CACHE_TIMES, 'generated': generated_cache_time, 'cache_hit': generated_cache_time}
+        
         # Database path
         self.db_path = os.getenv('DATABASE_PATH', './data/bot.db')
         
+        # Coordination between bot processes (quota buckets, generation leases):
+        # 'sqlite' for instances sharing DATABASE_PATH, 'redis' across hosts
+        self.coordination_backend = os.getenv('COORDINATION_BACKEND', 'sqlite').lower()
+        self.coordination_redis_url = os.getenv('COORDINATION_REDIS_URL', 'redis://localhost:6379/0')
+        
+        # Retention: expired rows are deleted in small batches, usage logs are
+        # rolled up per user and day first
+        self.api_requests_retention_days = float(os.getenv('API_REQUESTS_RETENTION_DAYS', 7))
+        self.usage_logs_retention_days = float(os.getenv('USAGE_LOGS_RETENTION_DAYS', 90))
+        self.retention_interval = float(os.getenv('RETENTION_INTERVAL_SECONDS', 3600))
+        self.retention_batch_size = int(os.getenv('RETENTION_BATCH_SIZE', 1000))
+        self.retention_time_budget = float(os.getenv('RETENTION_TIME_BUDGET_SECONDS', 5))
+        
         # Whitelist configuration
         self.whitelist_enabled = os.getenv('WHITELIST_ENABLED', 'true').lower() == 'true'
         self.whitelist_path = os.getenv('WHITELIST_PATH', './data/whitelist.json')
+        self.whitelist_reload_interval = float(os.getenv('WHITELIST_RELOAD_INTERVAL_SECONDS', 5))
+        
+        # Topic block/allow lists (default block list if the file doesn't exist)
+        self.topic_filter_path = os.getenv('TOPIC_FILTER_PATH', './data/topic_filter.json')
+        self.topic_filter_reload_interval = float(os.getenv('TOPIC_FILTER_RELOAD_INTERVAL_SECONDS', 5))
+        
+        # Update delivery: 'polling' (default) or 'webhook'
+        self.bot_mode = os.getenv('BOT_MODE', 'polling').lower()
+        self.webhook_url = os.getenv('WEBHOOK_URL', '')
+        self.webhook_listen = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+        self.webhook_port = int(os.getenv('WEBHOOK_PORT', 8443))
+        self.webhook_path = os.getenv('WEBHOOK_PATH', 'telegram')
+        self.webhook_secret_token = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+        self.telegram_api_base_url = os.getenv('TELEGRAM_API_BASE_URL', '')
+        
+        # Metrics endpoint (METRICS_PORT=0 disables) and periodic summary log
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = int(os.getenv('METRICS_PORT', 9464))
+        self.metrics_summary_interval = float(os.getenv('METRICS_SUMMARY_INTERVAL_SECONDS', 300))
+        
+        # Streaming mode: answer at once with a placeholder and write the
+        # message into it once chosen. Needs inline feedback enabled in
+        # @BotFather (/setinlinefeedback).
+        self.streaming_enabled = os.getenv('STREAMING_ENABLED', 'false').lower() == 'true'
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL_SECONDS', 1.0))
+        
+        # Pre-generation of popular topics with spare quota (needs the message cache)
+        self.pregeneration_enabled = os.getenv('PREGENERATION_ENABLED', 'false').lower() == 'true'
+        self.pregeneration_interval = float(os.getenv('PREGENERATION_INTERVAL_SECONDS', 600))
+        self.pregeneration_max_per_run = int(os.getenv('PREGENERATION_MAX_PER_RUN', 5))
+        self.pregeneration_lookback_days = float(os.getenv('PREGENERATION_LOOKBACK_DAYS', 7))
+        # Fraction of the per-minute quota that must be unused, and of the
+        # daily quota that is always left for users
+        self.pregeneration_min_minute_headroom = float(os.getenv('PREGENERATION_MIN_MINUTE_HEADROOM', 0.5))
+        self.pregeneration_day_reserve = float(os.getenv('PREGENERATION_DAY_RESERVE', 0.5))
+        
+        # Only subscribe to the update types we handle
+        self.allowed_updates = [Update.INLINE_QUERY]
+        if self.streaming_enabled:
+            self.allowed_updates.append(Update.CHOSEN_INLINE_RESULT)
         
         # Validate required environment variables
         if not self.token:
             raise ValueError("TELEGRAM_BOT_TOKEN is required")
         if not self.google_ai_key:
             raise ValueError("GOOGLE_AI_API_KEY is required")
+        if self.bot_mode not in ('polling', 'webhook'):
+            raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
         
         # Initialize services
         self.db = DatabaseManager(self.db_path)
-        self.ai_service = AIService(self.google_ai_key, self.model_name)
+        self.coordinator = create_coordinator(self.coordination_backend, self.db_path, self.coordination_redis_url)
+        self.topic_filter = TopicFilter(self.topic_filter_path)
+        self.backend_pool = BackendPool(
+            [
+                Backend(
+                    AIService(
+                        api_key, model_name,
+                        max_concurrent_requests=self.ai_max_concurrent_requests,
+                        request_timeout=self.ai_request_timeout,
+                        breaker=CircuitBreaker(
+                            failure_threshold=self.ai_backend_failure_threshold,
+                            reset_timeout=self.ai_backend_cooldown
+                        ),
+                        hedge_policy=HedgePolicy(
+                            enabled=self.ai_hedge_enabled,
+                            quantile=self.ai_hedge_quantile,
+                            max_hedge_ratio=self.ai_hedge_max_ratio
+                        ),
+                        topic_filter=self.topic_filter
+                    ),
+                    requests_per_minute, requests_per_day
+                )
+                for api_key, model_name, requests_per_minute, requests_per_day in self.ai_backends
+            ],
+            self.db, self.coordinator,
+            cooldown_seconds=self.ai_backend_cooldown
+        )
+        self.ai_service = self.backend_pool.backends[0].service
+        self.message_cache = MessageCache(
+            self.db, self.model_name,
+            variants=self.message_variants,
+            enabled=self.message_cache_enabled,
+            ttl_seconds=self.message_cache_ttl,
+            max_memory_entries=self.message_cache_max_entries,
+            max_db_entries=self.message_cache_max_db_entries,
+            similarity_threshold=self.message_cache_similarity_threshold if self.message_cache_similarity_enabled else None,
+            coordinator=self.coordinator
+        )
+        self.coalescer = RequestCoalescer()
+        self.generation_slots = GenerationSlots(self.max_inflight_generations)
+        self.debouncer = AdaptiveDebouncer(
+            max_delay=self.debounce_delay, min_delay=self.debounce_min_delay,
+            adaptive=self.debounce_adaptive, max_users=self.debounce_max_users
+        )
+        self.scheduler = FairScheduler(
+            self.db.rate_limiter, self.coordinator,
+            self.backend_pool.requests_per_minute, self.backend_pool.requests_per_day,
+            user_soft_cap=self.user_daily_soft_cap, over_cap_weight=self.user_over_cap_weight,
+            record_admission=self.db.record_admission
+        )
         self.whitelist = WhitelistManager(self.whitelist_path) if self.whitelist_enabled else None
         
         # Debouncing: Track pending queries per user
         self.pending_queries = {}
         
+        # Topics asked by several users lately, refreshed by the pre-generation job
+        self.trending_topics: List[str] = []
+        
         # Create application
-        self.application = Application.builder().token(self.token).build()
+        builder = (
+            Application.builder()
+            .token(self.token)
+            # Handle updates concurrently; otherwise each inline query (debounce
+            # plus generation) blocks every update queued behind it
+            .concurrent_updates(True)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        if self.telegram_api_base_url:
+            # e.g. a local Bot API server, or a fake one for testing
+            builder = builder.base_url(f"{self.telegram_api_base_url.rstrip('/')}/bot")
+        self.application = builder.build()
         
         # Add handlers
         self.application.add_handler(InlineQueryHandler(self.handle_inline_query))
+        if self.streaming_enabled:
+            self.application.add_handler(ChosenInlineResultHandler(self.handle_chosen_inline_result))
         
-        # Add job queue for cleanup task
+        # Add job queue for cleanup task (time-boxed, so it runs often to keep up)
         self.application.job_queue.run_repeating(
-            self.cleanup_job, interval=24*60*60, first=60  # Run every 24 hours, start after 1 minute
+            self.cleanup_job, interval=self.retention_interval, first=60  # Start after 1 minute
         )
         
+        # Pick up whitelist.json edits without a restart
+        if self.whitelist:
+            self.application.job_queue.run_repeating(
+                self.whitelist_reload_job, interval=self.whitelist_reload_interval, first=self.whitelist_reload_interval
+            )
+        
+        # Pick up topic_filter.json edits without a restart
+        self.application.job_queue.run_repeating(
+            self.topic_filter_reload_job, interval=self.topic_filter_reload_interval, first=self.topic_filter_reload_interval
+        )
+        
+        if self.metrics_summary_interval > 0:
+            self.application.job_queue.run_repeating(
+                self.metrics_summary_job, interval=self.metrics_summary_interval, first=self.metrics_summary_interval
+            )
+        
+        # Spend quota left unused in quiet periods on topics likely to be asked again
+        if self.pregeneration_enabled and self.message_cache_enabled:
+            self.application.job_queue.run_repeating(
+                self.pregeneration_job, interval=self.pregeneration_interval, first=self.pregeneration_interval
+            )
+        
+        self._register_metrics()
+        
         logger.info("VibeMessageBot initialized successfully")
     
+    async def _post_init(self, application: Application):
+        """Start background services once the event loop is running."""
+        await self.db.start()
+        await self.coordinator.start()
+        await self.message_cache.load_index()
+        
+        # Restore per-user soft caps, weights and today's usage for fair scheduling
+        start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.scheduler.load_user_state(
+            await self.db.get_user_limits(), await self.db.get_user_usage_counts(start_of_day)
+        )
+        await self.scheduler.start()
+        
+        if self.metrics_port:
+            try:
+                await metrics.start_server(self.metrics_host, self.metrics_port)
+            except OSError as e:
+                # E.g. another instance on this host already serves the port
+                logger.error("Metrics endpoint disabled, could not listen on %s:%s: %s",
+                             self.metrics_host, self.metrics_port, e)
+    
+    async def _post_shutdown(self, application: Application):
+        """Stop the scheduler and flush pending database writes on shutdown."""
+        await metrics.stop_server()
+        await self.scheduler.stop()
+        await self.coordinator.close()
+        await self.db.close()
+    
+    def _register_metrics(self):
+        """Expose component state that is read at scrape time."""
+        metrics.register_gauge('pending_queries', lambda: len(self.pending_queries))
+        metrics.register_gauge('inflight_generations', self.generation_slots.inflight)
+        metrics.register_gauge('db_write_queue_depth', self.db.queue_depth)
+        metrics.register_callback(
+            'message_cache', lambda: {
+                (('stat', name),): value for name, value in self.message_cache.stats().items()
+            }
+        )
+        metrics.register_callback(
+            'coalescer', lambda: {
+                (('stat', name),): value for name, value in self.coalescer.stats().items()
+            }
+        )
+        metrics.register_callback(
+            'debounce', lambda: {
+                (('stat', name),): value for name, value in self.debouncer.stats().items()
+            }
+        )
+        metrics.register_callback(
+            'topic_filter', lambda: {
+                (('stat', name),): value for name, value in self.topic_filter.stats().items()
+            }
+        )
+        metrics.register_callback(
+            'scheduler', lambda: {
+                (('stat', name),): value for name, value in self.scheduler.stats().items()
+            }
+        )
+        metrics.register_callback(
+            'backend', lambda: {
+                (('backend', backend['backend']), ('stat', name)): value
+                for backend in self.backend_pool.stats()
+                for name, value in backend.items() if name != 'backend'
+            }
+        )
+    
     async def handle_inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline queries with debouncing."""
         query = update.inline_query
         user_id = query.from_user.id
         search_query = query.query.strip()
         query_id = query.id
+        received_at = time.monotonic()
+        self.debouncer.observe(user_id, received_at)
         
-        logger.info(f"Received inline query from user {user_id}: '{search_query}' (ID: {query_id})")
+        # One event per keystroke; LOG_KEYSTROKE_SAMPLE_RATE thins these out
+        logger.info(
+            "Received inline query from user %s: '%s' (ID: %s)", user_id, search_query, query_id,
+            extra={'user_id': user_id, 'query_id': query_id, 'stage': 'received', 'sampled': True}
+        )
+        
+        # Shed load rather than let pending queries pile up without bound
+        if user_id not in self.pending_queries and len(self.pending_queries) >= self.max_pending_queries:
+            logger.warning("Too many pending queries, shedding query from user %s", user_id)
+            await self._answer(query, self._build_busy_results(), 'busy', received_at)
+            return
         
         # Cancel previous pending query for this user
         if user_id in self.pending_queries:
             old_task = self.pending_queries[user_id]
             if not old_task.done():
                 old_task.cancel()
-                logger.debug(f"Cancelled previous query for user {user_id}")
+                logger.debug("Cancelled previous query for user %s", user_id, extra={'user_id': user_id, 'sampled': True})
         
         # Create new debounced task
         task = asyncio.create_task(
-            self._process_debounced_query(query, user_id, search_query, query_id)
+            self._process_debounced_query(query, user_id, search_query, query_id, received_at)
         )
         self.pending_queries[user_id] = task
         
         try:
             await task
         except asyncio.CancelledError:
-            logger.debug(f"Query cancelled for user {user_id}")
+            metrics.inc('inline_queries_cancelled_total')
+            logger.debug("Query cancelled for user %s", user_id, extra={'user_id': user_id, 'sampled': True})
         except Exception as e:
-            logger.error(f"Error in debounced query: {e}")
+            logger.error("Error in debounced query: %s", e)
         finally:
             # Clean up completed task
             if user_id in self.pending_queries and self.pending_queries[user_id] == task:
                 del self.pending_queries[user_id]
     
-    async def _process_debounced_query(self, query, user_id: int, search_query: str, query_id: str):
+    async def _answer(self, query, results, outcome: str, received_at: float, **kwargs):
+        """Answer an inline query, recording its outcome and end-to-end latency."""
+        fields = {'user_id': query.from_user.id, 'query_id': query.id, 'stage': 'answer', 'outcome': outcome}
+        if time.monotonic() >= received_at + self.inline_query_timeout:
+            # Telegram rejects answers to expired queries
+            metrics.inc('inline_queries_total', outcome='expired')
+            logger.info("Not answering expired query %s (%s)", query.id, outcome, extra=fields)
+            return
+        
+        kwargs.setdefault('cache_time', self.answer_cache_times.get(outcome, 30))
+        # With the whitelist on, every answer depends on who is asking, so
+        # Telegram must not serve one user's cached answer to another
+        kwargs.setdefault('is_personal', self.whitelist is not None)
+        
+        with metrics.timer('inline_stage_seconds', stage='answer'):
+            await query.answer(results, **kwargs)
+        duration = time.monotonic() - received_at
+        metrics.inc('inline_queries_total', outcome=outcome)
+        metrics.observe('inline_query_seconds', duration, outcome=outcome)
+        logger.info(
+            "Answered query %s (%s) in %.0f ms", query.id, outcome, duration * 1000,
+            extra={**fields, 'duration_ms': round(duration * 1000, 1)}
+        )
+    
+    async def _process_debounced_query(self, query, user_id: int, search_query: str, query_id: str, received_at: float):
         """Process query after debounce delay."""
-        # Wait for debounce delay
-        await asyncio.sleep(self.debounce_delay)
+        # Finished-looking, empty and already-cached queries are answered right
+        # away, as is everything in streaming mode (answers spend no quota there);
+        # otherwise wait for as long as this user usually pauses between keystrokes
+        if (not search_query or self.streaming_enabled
+                or self.message_cache.contains(search_query, self.min_message_length, self.max_message_length)):
+            delay = 0.0
+        else:
+            delay = self.debouncer.delay_for(user_id, search_query)
         
-        logger.info(f"Processing debounced query from user {user_id}: '{search_query}'")
+        dispatched = False
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.debouncer.record_skipped()
+            dispatched = True
+            metrics.observe('inline_stage_seconds', time.monotonic() - received_at, stage='debounce')
+            
+            await self._process_query(query, user_id, search_query, query_id, received_at)
+        except asyncio.CancelledError:
+            self.debouncer.record_cancelled(dispatched)
+            raise
+        else:
+            self.debouncer.record_completed()
+    
+    async def _process_query(self, query, user_id: int, search_query: str, query_id: str, received_at: float):
+        """Answer an inline query once the user has stopped typing."""
+        # Generation must end in time to still send the answer
+        deadline = received_at + self.inline_query_timeout - ANSWER_MARGIN_SECONDS
+        
+        logger.info(
+            "Processing debounced query from user %s: '%s'", user_id, search_query,
+            extra={'user_id': user_id, 'query_id': query_id, 'stage': 'debounced', 'sampled': True}
+        )
         
         # Check whitelist if enabled
         if self.whitelist_enabled and self.whitelist:
-            if not self.whitelist.is_user_whitelisted(user_id):
+            with metrics.timer('inline_stage_seconds', stage='whitelist'):
+                whitelisted = self.whitelist.is_user_whitelisted(user_id)
+            if not whitelisted:
                 results = [
-                    InlineQueryResultArticle(
-                        id=str(uuid.uuid4()),
+                    self._build_card(
                         title="🚫 Access Denied",
                         description="You are not authorized to use this bot",
-                        input_message_content=InputTextMessageContent(
-                            message_text="Sorry, you are not authorized to use this bot. Please contact the administrator for access."
-                        )
+                        message_text="Sorry, you are not authorized to use this bot. Please contact the administrator for access."
                     )
                 ]
-                await query.answer(results, cache_time=300)
-                logger.warning(f"Unauthorized access attempt from user {user_id}")
+                await self._answer(query, results, 'denied', received_at)
+                logger.warning("Unauthorized access attempt from user %s", user_id)
                 return
         
-        # If query is empty, show help
+        # If query is empty, show the user's recent and pre-generated topics, then help
         if not search_query:
-            results = [
-                InlineQueryResultArticle(
-                    id=str(uuid.uuid4()),
-                    title="💡 How to use VibeMessageBot",
-                    description="Type a topic or message to generate content",
-                    input_message_content=InputTextMessageContent(
-                        message_text="Usage: @vibemessagebot <topic>\nExample: @vibemessagebot IPv6\nOr: @vibemessagebot I think IPv6 is great because..."
-                    )
-                )
-            ]
-            await query.answer(results, cache_time=300)
-            return
-        
-        # Check API rate limits (project-level, not user-level)
-        can_proceed, error_message = await self.db.check_api_rate_limit(
-            self.api_requests_per_minute, self.api_requests_per_day
-        )
-        
-        if not can_proceed:
-            results = [
-                InlineQueryResultArticle(
-                    id=str(uuid.uuid4()),
-                    title="⚠️ API Rate Limit Exceeded",
-                    description=error_message,
-                    input_message_content=InputTextMessageContent(
-                        message_text=f"API rate limit exceeded. Please try again later.\n\n{error_message}"
-                    )
-                )
-            ]
-            await query.answer(results, cache_time=60)
+            with metrics.timer('inline_stage_seconds', stage='suggestions'):
+                results = await self._build_suggestion_results(user_id)
+            help_card = self._build_card(
+                title="💡 How to use VibeMessageBot",
+                description="Type a topic or message to generate content",
+                message_text="Usage: @vibemessagebot <topic>\nExample: @vibemessagebot IPv6\nOr: @vibemessagebot I think IPv6 is great because..."
+            )
+            if results:
+                # Suggestions depend on who is asking
+                await self._answer(query, results + [help_card], 'suggestions', received_at, is_personal=True)
+            else:
+                await self._answer(query, [help_card], 'help', received_at)
             return
         
         # Check if topic is appropriate
-        if not self.ai_service.is_appropriate_topic(search_query):
+        with metrics.timer('inline_stage_seconds', stage='topic_filter'):
+            appropriate = self.ai_service.is_appropriate_topic(search_query)
+        if not appropriate:
             results = [
-                InlineQueryResultArticle(
-                    id=str(uuid.uuid4()),
+                self._build_card(
                     title="❌ Inappropriate Content",
                     description="This topic is not suitable for content generation",
-                    input_message_content=InputTextMessageContent(
-                        message_text="Sorry, I cannot generate content for this topic. Please try a different subject."
-                    )
+                    message_text="Sorry, I cannot generate content for this topic. Please try a different subject."
                 )
             ]
-            await query.answer(results, cache_time=300)
+            await self._answer(query, results, 'inappropriate', received_at)
             return
         
-        try:
-            # Record the API request attempt
-            await self.db.record_api_request(success=False)  # Start as failed, update on success
-            
-            # Generate message
-            logger.info(f"Generating message for topic: '{search_query}'")
-            generated_message = self.ai_service.generate_message(
+        # Serve from the message cache without spending API quota
+        with metrics.timer('inline_stage_seconds', stage='cache_lookup'):
+            cached_messages = await self.message_cache.get(
                 search_query, self.min_message_length, self.max_message_length
             )
+        
+        if cached_messages:
+            self.db.log_usage(user_id, search_query, len(cached_messages[0].text), True)
+            await self._answer(query, self._build_message_results(cached_messages), 'cache_hit', received_at)
+            logger.info("Served cached message for user %s", user_id)
+            return
+        
+        # Generate only once the user picks the placeholder
+        if self.streaming_enabled:
+            await self._answer(query, [self._build_stream_card(search_query)], 'streaming', received_at)
+            return
+        
+        # Identical in-flight requests share one generation
+        cache_key = self.message_cache.make_key(search_query, self.min_message_length, self.max_message_length)
+        
+        if not self.coalescer.is_inflight(cache_key) and self.generation_slots.locked():
+            logger.warning("Too many generations in flight, shedding query from user %s", user_id)
+            await self._answer(query, self._build_busy_results(), 'busy', received_at)
+            return
+        
+        outcome = 'generated'
+        try:
+            # Joining an in-flight generation spends no extra quota; a new one
+            # waits for fair admission against the API rate limits. Stop waiting
+            # at the deadline; the generation itself finishes and is cached.
+            with metrics.timer('inline_stage_seconds', stage='generate'):
+                generated_messages = await self.coalescer.run(
+                    cache_key, lambda: self._generate_messages(search_query, user_id, deadline),
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
             
-            if generated_message:
-                # Update to successful API request
-                await self.db.record_api_request(success=True)
-                
+            if generated_messages:
                 # Log successful usage
-                self.db.log_usage(user_id, search_query, len(generated_message), True)
+                self.db.log_usage(user_id, search_query, len(generated_messages[0].text), True)
                 
-                results = [
-                    InlineQueryResultArticle(
-                        id=str(uuid.uuid4()),
-                        title="✨ Generated Message",
-                        description=f"{generated_message[:100]}..." if len(generated_message) > 100 else generated_message,
-                        input_message_content=InputTextMessageContent(
-                            message_text=generated_message
-                        )
-                    )
-                ]
+                results = self._build_message_results(generated_messages)
                 
-                logger.info(f"Successfully generated message for user {user_id}")
+                logger.info("Successfully generated message for user %s", user_id)
             else:
                 # Log failed usage
                 self.db.log_usage(user_id, search_query, 0, False)
+                outcome = 'failed'
                 
                 results = [
-                    InlineQueryResultArticle(
-                        id=str(uuid.uuid4()),
+                    self._build_card(
                         title="❌ Generation Failed",
                         description="Unable to generate message. Please try again.",
-                        input_message_content=InputTextMessageContent(
-                            message_text="Sorry, I couldn't generate a message for that topic. Please try again with a different topic."
-                        )
+                        message_text="Sorry, I couldn't generate a message for that topic. Please try again with a different topic."
                     )
                 ]
                 
-                logger.warning(f"Failed to generate message for user {user_id}")
+                logger.warning("Failed to generate message for user %s", user_id)
+            
+        except CircuitOpenError as e:
+            # Gemini is down: fail fast with whatever we generated for this topic before
+            stale_messages = await self.message_cache.get_stale(
+                search_query, self.min_message_length, self.max_message_length
+            )
+            if stale_messages:
+                self.db.log_usage(user_id, search_query, len(stale_messages[0].text), True)
+                await self._answer(query, self._build_message_results(stale_messages), 'stale', received_at)
+                logger.info("Served stale cached message for user %s: %s", user_id, e)
+                return
             
+            self.db.log_usage(user_id, search_query, 0, False)
+            outcome = 'unavailable'
+            results = [
+                self._build_card(
+                    title="🔌 Service Unavailable",
+                    description="The AI service is having problems. Please try again later.",
+                    message_text="Sorry, the AI service is temporarily unavailable. Please try again later."
+                )
+            ]
+            logger.warning("No generation for user %s: %s", user_id, e)
+        
+        except RateLimitExceeded as e:
+            results = [
+                self._build_card(
+                    title="⚠️ API Rate Limit Exceeded",
+                    description=str(e),
+                    message_text=f"API rate limit exceeded. Please try again later.\n\n{str(e)}"
+                )
+            ]
+            await self._answer(query, results, 'rate_limited', received_at)
+            return
+        
+        except (DeadlineExceeded, asyncio.TimeoutError) as e:
+            # Not a quota problem: the answer would not have been ready in time
+            logger.info("No answer in time for user %s: %s", user_id, str(e) or "generation still running")
+            await self._answer(query, self._build_deadline_results(), 'deadline', received_at)
+            return
+        
         except Exception as e:
-            logger.error(f"Error processing inline query: {str(e)}")
+            logger.error("Error processing inline query: %s", e)
             
             # Log failed usage
             self.db.log_usage(user_id, search_query, 0, False)
+            outcome = 'error'
             
             results = [
-                InlineQueryResultArticle(
-                    id=str(uuid.uuid4()),
+                self._build_card(
                     title="❌ Error",
                     description="An error occurred. Please try again.",
-                    input_message_content=InputTextMessageContent(
-                        message_text="Sorry, an error occurred while processing your request. Please try again."
-                    )
+                    message_text="Sorry, an error occurred while processing your request. Please try again."
                 )
             ]
         
-        await query.answer(results, cache_time=30)
+        await self._answer(query, results, outcome, received_at)
+    
+    def _check_budget(self, deadline: float):
+        """Raise DeadlineExceeded if a typical Gemini call no longer fits before the deadline."""
+        if deadline - time.monotonic() < self.backend_pool.expected_latency():
+            raise DeadlineExceeded("Not enough time left for a Gemini call before the deadline")
+    
+    async def _generate_messages(self, search_query: str, user_id: int, deadline: float) -> List[Variant]:
+        """Generate message variants, unless another bot process already is, and cache the result."""
+        if not self.message_cache.enabled:
+            return await self._generate_and_cache(search_query, user_id, deadline)
+        
+        lease = f"generate:{self.message_cache.make_key(search_query, self.min_message_length, self.max_message_length)}"
+        lease_ttl = self.inline_query_timeout + self.ai_request_timeout
+        while not await self.coordinator.try_lock(lease, lease_ttl):
+            # Another instance is generating this topic; use its result
+            messages = await self._wait_for_peer_generation(search_query, lease, deadline)
+            if messages:
+                metrics.inc('peer_generations_reused_total')
+                return messages
+        
+        try:
+            return await self._generate_and_cache(search_query, user_id, deadline)
+        finally:
+            # Release only once the cached result is visible to the waiting
+            # instances (written to SQLite, or shared through Redis by put)
+            await self.db.flush()
+            await self.coordinator.unlock(lease)
+    
+    async def _wait_for_peer_generation(self, search_query: str, lease: str, deadline: float) -> List[Variant]:
+        """Poll the shared cache until another process's generation lands or its lease ends."""
+        while time.monotonic() < deadline:
+            await asyncio.sleep(PEER_GENERATION_POLL_SECONDS)
+            released = not await self.coordinator.is_locked(lease)
+            messages = await self.message_cache.refresh(
+                search_query, self.min_message_length, self.max_message_length
+            )
+            if messages or released:
+                return messages or []
+        raise DeadlineExceeded("Another instance's generation did not finish before the deadline")
+    
+    async def _generate_and_cache(self, search_query: str, user_id: int, deadline: float) -> List[Variant]:
+        """Generate message variants, record the API request and cache the result."""
+        async with self.generation_slots:
+            # Don't spend quota on an answer that would arrive too late
+            self._check_budget(deadline)
+            
+            # Wait for a fair share of the API quota
+            with metrics.timer('inline_stage_seconds', stage='admission_wait'):
+                await self.scheduler.acquire(user_id, deadline)
+            self._check_budget(deadline)
+            
+            # Generate all variants in a single request; the pool records the
+            # API request against whichever backend serves it
+            logger.info("Generating %s message(s) for topic: '%s'", self.message_variants, search_query)
+            generated_messages = await self.backend_pool.generate_variants_async(
+                search_query, self.message_variants, self.min_message_length, self.max_message_length
+            )
+        
+        if generated_messages:
+            # Cache for later queries on the same topic
+            await self.message_cache.put(
+                search_query, self.min_message_length, self.max_message_length, generated_messages
+            )
+        
+        return generated_messages
+    
+    @staticmethod
+    def _result_id(*parts: str) -> str:
+        """Derive a stable result ID from the result's content."""
+        return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()[:32]
+    
+    def _build_card(self, title: str, description: str, message_text: str) -> InlineQueryResultArticle:
+        """Build an article result whose ID only changes when its content does.
+        
+        Identical answers then carry identical IDs, so Telegram can recognize
+        them instead of seeing a new result on every keystroke.
+        """
+        return InlineQueryResultArticle(
+            id=self._result_id(title, message_text),
+            title=title,
+            description=description,
+            input_message_content=InputTextMessageContent(
+                message_text=message_text
+            )
+        )
+    
+    async def handle_chosen_inline_result(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stream a message into a placeholder the user just sent."""
+        chosen = update.chosen_inline_result
+        if not chosen.result_id.startswith(STREAM_RESULT_PREFIX):
+            return
+        if not chosen.inline_message_id:
+            logger.warning("Chosen placeholder has no inline message ID to edit")
+            return
+        
+        user_id = chosen.from_user.id
+        search_query = chosen.query.strip()
+        
+        # The whitelist or filter may have changed since the placeholder was offered
+        if self.whitelist_enabled and self.whitelist and not self.whitelist.is_user_whitelisted(user_id):
+            return
+        if not search_query or not self.ai_service.is_appropriate_topic(search_query):
+            return
+        
+        try:
+            await self._stream_message(chosen.inline_message_id, user_id, search_query)
+        except Exception as e:
+            logger.error("Error streaming message: %s", e)
+    
+    async def _stream_message(self, inline_message_id: str, user_id: int, search_query: str):
+        """Generate a message into a sent inline message, editing it as text arrives."""
+        editor = StreamingMessageEditor(
+            self.application.bot, inline_message_id, self.stream_edit_interval,
+            reply_markup=self._build_stream_keyboard(search_query)
+        )
+        started = time.monotonic()
+        
+        message = await self.message_cache.get(search_query, self.min_message_length, self.max_message_length)
+        if message:
+            outcome = 'cache_hit'
+            message = message[0].text
+        else:
+            outcome, message = await self._stream_generation(editor, user_id, search_query, started)
+        
+        if outcome in ('cache_hit', 'generated', 'stale'):
+            self.db.log_usage(user_id, search_query, len(message), True)
+        else:
+            self.db.log_usage(user_id, search_query, 0, False)
+        
+        await editor.finish(message)
+        metrics.inc('streams_total', outcome=outcome)
+        metrics.observe('stream_seconds', time.monotonic() - started, outcome=outcome)
+        logger.info(
+            "Streamed message for user %s (%s, %s edits)", user_id, outcome, editor.edits,
+            extra={'user_id': user_id, 'stage': 'stream', 'outcome': outcome,
+                   'duration_ms': round((time.monotonic() - started) * 1000, 1)}
+        )
+    
+    async def _stream_generation(self, editor: StreamingMessageEditor, user_id: int,
+                                 search_query: str, started: float) -> Tuple[str, str]:
+        """Stream Gemini output into the editor; returns (outcome, final text)."""
+        text = ''
+        try:
+            async with self.generation_slots:
+                with metrics.timer('inline_stage_seconds', stage='admission_wait'):
+                    await self.scheduler.acquire(user_id, time.monotonic() + self.inline_query_timeout)
+                
+                logger.info("Streaming message for topic: '%s'", search_query)
+                async for chunk in self.backend_pool.stream_message_async(
+                    search_query, self.min_message_length, self.max_message_length
+                ):
+                    if not text:
+                        first_token = time.monotonic() - started
+                        metrics.observe('stream_first_token_seconds', first_token)
+                        logger.info("First token after %.2fs", first_token)
+                    text += chunk
+                    await editor.update(text)
+        
+        except CircuitOpenError:
+            stale_messages = await self.message_cache.get_stale(
+                search_query, self.min_message_length, self.max_message_length
+            )
+            if stale_messages:
+                return 'stale', stale_messages[0].text
+            return 'unavailable', "Sorry, the AI service is temporarily unavailable. Please try again later."
+        
+        except RateLimitExceeded as e:
+            return 'rate_limited', f"API rate limit exceeded. Please try again later.\n\n{str(e)}"
+        
+        except DeadlineExceeded:
+            return 'deadline', "The bot is busy right now. Please try again in a moment."
+        
+        except Exception as e:
+            logger.error("Error streaming message: %s", str(e) or type(e).__name__)
+            return 'error', "Sorry, an error occurred while processing your request. Please try again."
+        
+        if not text.strip():
+            return 'failed', "Sorry, I couldn't generate a message for that topic. Please try again with a different topic."
+        
+        message = self.ai_service.validate_message(text, self.min_message_length, self.max_message_length)
+        if self.message_variants == 1:
+            # Later queries on this topic are then answered from the cache
+            await self.message_cache.put(search_query, self.min_message_length, self.max_message_length, [Variant(message)])
+        return 'generated', message
+    
+    def _build_stream_card(self, topic: str) -> InlineQueryResultArticle:
+        """Build the placeholder a message is streamed into once chosen."""
+        return InlineQueryResultArticle(
+            id=STREAM_RESULT_PREFIX + self._result_id(topic),
+            title=f"✨ Generate about {topic}",
+            description="The message is written as soon as you send it",
+            input_message_content=InputTextMessageContent(
+                message_text=f"✍️ Generating about {topic}…"
+            ),
+            # Telegram only reports the sent message's ID for results with a keyboard
+            reply_markup=self._build_stream_keyboard(topic)
+        )
+    
+    def _build_stream_keyboard(self, topic: str) -> InlineKeyboardMarkup:
+        """Build the keyboard of a streamed message, kept on every edit."""
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔁 Another one", switch_inline_query_current_chat=topic)]
+        ])
+    
+    async def _build_suggestion_results(self, user_id: int) -> List[InlineQueryResultArticle]:
+        """Build results for the user's recent topics and trending topics that are cached."""
+        try:
+            recent_topics = await self.db.get_recent_user_topics(user_id, SUGGESTED_RECENT_TOPICS)
+        except Exception as e:
+            logger.error("Error reading recent topics: %s", e)
+            recent_topics = []
+        
+        candidates = []
+        seen = set()
+        for icon, topics in (('🕘', recent_topics), ('🔥', self.trending_topics[:SUGGESTED_TRENDING_TOPICS])):
+            for topic in topics:
+                if normalize_topic(topic) not in seen:
+                    seen.add(normalize_topic(topic))
+                    candidates.append((icon, topic))
+        
+        # Runs on every empty-query keystroke, so all topics are read at once
+        cached = await self.message_cache.peek_many(
+            [topic for _, topic in candidates], self.min_message_length, self.max_message_length
+        )
+        
+        results = []
+        for icon, topic in candidates:
+            if topic in cached:
+                message = cached[topic][0].text
+                results.append(self._build_card(
+                    title=f"{icon} {topic}",
+                    description=f"{message[:100]}..." if len(message) > 100 else message,
+                    message_text=message
+                ))
+        return results
+    
+    def _build_busy_results(self) -> List[InlineQueryResultArticle]:
+        """Build the result shown when a query is shed under load."""
+        return [
+            self._build_card(
+                title="⏳ Busy",
+                description="Too many requests right now. Please try again in a moment.",
+                message_text="The bot is busy right now. Please try again in a moment."
+            )
+        ]
+    
+    def _build_deadline_results(self) -> List[InlineQueryResultArticle]:
+        """Build the result shown when a message could not be ready before the deadline."""
+        return [
+            self._build_card(
+                title="⏳ Busy, Try Again",
+                description="This is taking longer than usual. Please try again in a moment.",
+                message_text="The bot is busy right now. Please try again in a moment."
+            )
+        ]
+    
+    def _build_message_results(self, messages: List[Variant]) -> List[InlineQueryResultArticle]:
+        """Build inline results for generated messages, one per variant, titled by tone."""
+        results = []
+        for i, (message, tone) in enumerate(messages):
+            if len(messages) == 1:
+                title = "✨ Generated Message"
+            elif tone:
+                title = f"✨ {tone.capitalize()} take"
+            else:
+                title = f"✨ Take {i + 1}"
+            results.append(self._build_card(
+                title=title,
+                description=f"{message[:100]}..." if len(message) > 100 else message,
+                message_text=message
+            ))
+        return results
+    
+    async def whitelist_reload_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Reload the whitelist when the file changes on disk."""
+        try:
+            self.whitelist.check_for_changes()
+        except Exception as e:
+            logger.error("Error in whitelist reload job: %s", e)
+    
+    async def metrics_summary_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Log a periodic summary of latencies and counters."""
+        logger.info("Metrics summary: %s", metrics.summary())
+    
+    async def topic_filter_reload_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Reload the topic filter when the file changes on disk."""
+        try:
+            self.topic_filter.check_for_changes()
+        except Exception as e:
+            logger.error("Error in topic filter reload job: %s", e)
     
     async def cleanup_job(self, context: ContextTypes.DEFAULT_TYPE):
         """Periodic cleanup job."""
         try:
             # Clean up old database records
-            self.db.cleanup_old_records()
-            logger.info("Completed periodic database cleanup")
+            await self.db.cleanup_old_records(
+                api_retention_days=self.api_requests_retention_days,
+                usage_retention_days=self.usage_logs_retention_days,
+                batch_size=self.retention_batch_size,
+                time_budget=self.retention_time_budget
+            )
+            
+            # Evict expired and excess cached messages
+            evicted = await self.message_cache.evict()
+            logger.info("Completed periodic database cleanup (%s cached messages evicted)", evicted)
+        except Exception as e:
+            logger.error("Error in cleanup job: %s", e)
+    
+    def _has_idle_headroom(self) -> bool:
+        """Check that no user is waiting and the rate limiter reports quota to spare."""
+        if self.pending_queries or self.scheduler.stats()['queue_depth'] or self.coalescer.stats()['inflight']:
+            return False
+        
+        requests_per_minute = self.backend_pool.requests_per_minute
+        requests_per_day = self.backend_pool.requests_per_day
+        minute_left, day_left = self.db.rate_limiter.remaining(requests_per_minute, requests_per_day)
+        return (
+            minute_left >= requests_per_minute * self.pregeneration_min_minute_headroom
+            and day_left > requests_per_day * self.pregeneration_day_reserve
+        )
+    
+    async def _pregeneration_topics(self) -> List[str]:
+        """Mine the usage logs for trending topics, then each user's repeated topics."""
+        since = datetime.utcnow() - timedelta(days=self.pregeneration_lookback_days)
+        trending = await self.db.get_trending_topics(since)
+        frequent = await self.db.get_frequent_user_topics(since)
+        self.trending_topics = [topic for topic, _ in trending]
+        
+        topics = []
+        seen = set()
+        for topic in self.trending_topics + [topic for _, topic, _ in frequent]:
+            if normalize_topic(topic) not in seen:
+                seen.add(normalize_topic(topic))
+                topics.append(topic)
+        return topics
+    
+    async def pregeneration_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Pre-generate and cache messages for likely topics while the quota goes unused."""
+        try:
+            topics = await self._pregeneration_topics()
+            generated = 0
+            for topic in topics:
+                if generated >= self.pregeneration_max_per_run or not self._has_idle_headroom():
+                    break
+                if not self.ai_service.is_appropriate_topic(topic):
+                    continue
+                if await self.message_cache.peek(topic, self.min_message_length, self.max_message_length):
+                    continue
+                
+                # Through the coalescer, so a user asking meanwhile joins this generation
+                cache_key = self.message_cache.make_key(topic, self.min_message_length, self.max_message_length)
+                deadline = time.monotonic() + self.inline_query_timeout
+                messages = await self.coalescer.run(
+                    cache_key, lambda: self._generate_messages(topic, PREGENERATION_USER_ID, deadline)
+                )
+                if messages:
+                    generated += 1
+                    metrics.inc('pregenerated_total')
+            
+            logger.info("Pre-generated messages for %s of %s candidate topics", generated, len(topics))
+        except (CircuitOpenError, RateLimitExceeded, DeadlineExceeded) as e:
+            logger.info("Stopped pre-generation: %s", e)
         except Exception as e:
-            logger.error(f"Error in cleanup job: {str(e)}")
+            logger.error("Error in pre-generation job: %s", e)
     
     async def cleanup_task(self):
         """Periodic cleanup task (legacy - replaced by cleanup_job)."""
@@ -280,21 +1043,33 @@ class VibeMessageBot:
                 await asyncio.sleep(24 * 60 * 60)
                 
                 # Clean up old database records
-                self.db.cleanup_old_records()
+                await self.db.cleanup_old_records()
                 logger.info("Completed periodic database cleanup")
                 
             except Exception as e:
-                logger.error(f"Error in cleanup task: {str(e)}")
+                logger.error("Error in cleanup task: %s", e)
     
     def run(self):
         """Run the bot."""
         logger.info("Starting VibeMessageBot...")
         
-        # Run the bot with cleanup task
-        self.application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        if self.bot_mode == 'webhook':
+            # Telegram pushes updates to python-telegram-bot's built-in webhook server
+            logger.info("Listening for webhook updates on %s:%s/%s", self.webhook_listen, self.webhook_port, self.webhook_path)
+            self.application.run_webhook(
+                listen=self.webhook_listen,
+                port=self.webhook_port,
+                url_path=self.webhook_path,
+                webhook_url=self.webhook_url or None,
+                secret_token=self.webhook_secret_token or None,
+                allowed_updates=self.allowed_updates,
+                drop_pending_updates=True
+            )
+        else:
+            self.application.run_polling(
+                allowed_updates=self.allowed_updates,
+                drop_pending_updates=True
+            )
 
 def main():
     """Main entry point."""
@@ -310,7 +1085,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Fatal error: {str(e)}")
+        logger.error("Fatal error: %s", e)
         sys.exit(1)
 
 if __name__ == '__main__':
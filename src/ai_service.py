@@ -1,20 +1,56 @@
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+import time
 import logging
-from typing import Optional
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from message_cache import Variant
+from metrics import metrics
+from resilience import CircuitBreaker, CircuitOpenError, HedgePolicy
+from topic_filter import TopicFilter
 
 logger = logging.getLogger(__name__)
 
+# Tones requested for multi-variant generation, in order
+VARIANT_TONES = ["insightful", "casual", "punchy", "detailed", "opinionated"]
+
+# Errors meaning the backend itself is failing (counted by the circuit breaker)
+BACKEND_FAILURES = (
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
 class AIService:
-    def __init__(self, api_key: str, model_name: str = "gemini-2.0-flash-lite"):
+    def __init__(self, api_key: str, model_name: str = "gemini-2.0-flash-lite",
+                 max_concurrent_requests: int = 4, request_timeout: float = 10.0,
+                 breaker: Optional[CircuitBreaker] = None, hedge_policy: Optional[HedgePolicy] = None,
+                 topic_filter: Optional[TopicFilter] = None):
         self.api_key = api_key
         self.model_name = model_name
+        self.request_timeout = request_timeout
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model_name)
+        
+        # Bounds the number of Gemini calls in flight at once
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        
+        # Fail fast during outages; duplicate slow calls to cut the latency tail
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_policy = hedge_policy or HedgePolicy(enabled=False)
+        
+        # Called before sending a hedge request; returns False if there is no
+        # quota for it. Hedging is off until the owner sets this.
+        self.reserve_hedge: Optional[Callable[[], Awaitable[bool]]] = None
+        
+        self.topic_filter = topic_filter or TopicFilter()
     
-    def generate_message(self, topic: str, min_length: int = 300, max_length: int = 400) -> Optional[str]:
-        """Generate a message about the given topic."""
-        try:
-            prompt = f"""
+    def _build_prompt(self, topic: str, min_length: int, max_length: int) -> str:
+        """Build the generation prompt for a topic."""
+        return f"""
 Write a brief message ({min_length}-{max_length} characters) about: "{topic}"
 
 Guidelines:
@@ -28,35 +64,266 @@ Guidelines:
 
 Topic: {topic}
 """
+    
+    def _build_variants_prompt(self, topic: str, count: int, min_length: int, max_length: int) -> str:
+        """Build a prompt asking for several variants as a JSON array."""
+        tones = ", ".join(VARIANT_TONES[:count])
+        return f"""
+Write {count} different brief messages ({min_length}-{max_length} characters each) about: "{topic}"
+
+Guidelines:
+- Write from the point of view of a senior software engineer
+- Use a different tone for each message, in this order: {tones}
+- Include technical insights where relevant
+- Keep each one concise and impactful
+- Do not use quotes or special formatting inside the messages
+
+Respond with only a JSON array of {count} objects, each with a "tone" and a "message" field.
+
+Topic: {topic}
+"""
+    
+    def validate_message(self, message: str, min_length: int, max_length: int) -> str:
+        """Check the length of a generated message and trim it if far too long."""
+        message = message.strip()
+        
+        # Basic validation
+        if len(message) < min_length * 0.8:  # Allow 20% tolerance
+            logger.warning("Generated message too short: %s characters", len(message))
+        elif len(message) > max_length * 1.2:  # Allow 20% tolerance
+            logger.warning("Generated message too long: %s characters", len(message))
+            message = message[:max_length] + "..."
+        
+        return message
+    
+    def _extract_message(self, response, min_length: int, max_length: int) -> Optional[str]:
+        """Validate and trim the text of a Gemini response."""
+        if response.text:
+            return self.validate_message(response.text, min_length, max_length)
+        else:
+            logger.error("Empty response from AI service")
+            return None
+    
+    def _extract_variants(self, response, count: int, min_length: int, max_length: int) -> List[Variant]:
+        """Parse the JSON array of variants from a Gemini response.
+        
+        A variant keeps its tone only if it is one of VARIANT_TONES.
+        """
+        text = (response.text or "").strip()
+        if not text:
+            logger.error("Empty response from AI service")
+            return []
+        
+        # Tolerate a fenced code block around the JSON
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("["):] if "[" in text else text
+        
+        try:
+            items = json.loads(text)
+        except ValueError:
+            # Usually an array cut off at the token limit; not worth caching
+            logger.error("Could not parse variants as JSON, treating the generation as failed")
+            return []
+        
+        messages = []
+        for item in items if isinstance(items, list) else []:
+            message = item.get("message") if isinstance(item, dict) else item
+            tone = item.get("tone") if isinstance(item, dict) else None
+            if isinstance(message, str) and message.strip():
+                tone = tone.strip().lower() if isinstance(tone, str) else None
+                messages.append(Variant(
+                    self.validate_message(message, min_length, max_length),
+                    tone if tone in VARIANT_TONES else None,
+                ))
+        
+        if len(messages) < count:
+            logger.warning("Expected %s variants, got %s", count, len(messages))
+        return messages[:count]
+    
+    async def _generate_content_async(self, prompt: str, generation_config: Optional[dict] = None):
+        """Call Gemini through the circuit breaker, hedging slow calls.
+        
+        Raises CircuitOpenError without calling the API while the breaker is open.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.model_name}")
+        
+        try:
+            response = await self._hedged_call(prompt, generation_config)
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except BACKEND_FAILURES:
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            self.breaker.record_success()  # The API answered; the request was at fault
+            raise
+        
+        self.breaker.record_success()
+        return response
+    
+    async def _hedged_call(self, prompt: str, generation_config: Optional[dict]):
+        """Send the request, and a second one if the first is slower than usual.
+        
+        The first successful response wins and the other request is cancelled.
+        """
+        self.hedge_policy.requests += 1
+        primary = asyncio.ensure_future(self._call_api(prompt, generation_config))
+        hedge = None
+        try:
+            delay = self.hedge_policy.delay(
+                metrics.get_histogram('gemini_request_seconds', model=self.model_name, outcome='ok')
+            )
+            if delay is None or self.reserve_hedge is None:
+                return await primary
+            
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.hedge_policy.may_hedge() or not await self.reserve_hedge():
+                return await primary
             
-            response = self.model.generate_content(prompt)
+            self.hedge_policy.hedges += 1
+            logger.debug("Hedging request to %s after %.2fs", self.model_name, delay)
+            hedge = asyncio.ensure_future(self._call_api(prompt, generation_config))
             
-            if response.text:
-                message = response.text.strip()
-                
-                # Basic validation
-                if len(message) < min_length * 0.8:  # Allow 20% tolerance
-                    logger.warning(f"Generated message too short: {len(message)} characters")
-                elif len(message) > max_length * 1.2:  # Allow 20% tolerance
-                    logger.warning(f"Generated message too long: {len(message)} characters")
-                    message = message[:max_length] + "..."
-                
-                return message
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_policy.hedge_wins += 1
+                        return task.result()
+            
+            # Both failed; report the original error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def _ensure_client(self):
+        """Give the model an async client that uses this service's API key.
+        
+        genai.configure is process-wide, and google-generativeai 0.8.5 has no
+        public way to set the key per model, so this sets the private
+        GenerativeModel._async_client that generate_content_async uses when
+        present. Check it when upgrading the SDK. Created lazily so the gRPC
+        channel binds to the running loop.
+        """
+        if self.model._async_client is None:
+            self.model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": self.api_key})
+    
+    async def _call_api(self, prompt: str, generation_config: Optional[dict]):
+        """Call Gemini asynchronously with bounded concurrency and a timeout."""
+        self._ensure_client()
+        
+        async with self._semaphore:
+            # Only outcome="ok" durations are real latencies; cancelled calls
+            # (debounce, losing hedges) and timeouts are cut short or capped,
+            # and errors such as quota rejections return early
+            started = time.perf_counter()
+            outcome = 'cancelled'
+            try:
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(prompt, generation_config=generation_config),
+                    timeout=self.request_timeout
+                )
+                outcome = 'ok'
+                return response
+            except asyncio.TimeoutError:
+                outcome = 'timeout'
+                raise
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                metrics.observe(
+                    'gemini_request_seconds', time.perf_counter() - started, model=self.model_name, outcome=outcome
+                )
+    
+    async def stream_message(self, topic: str, min_length: int = 300, max_length: int = 400) -> AsyncIterator[str]:
+        """Stream a message about the topic as text chunks, raising API errors.
+        
+        The timeout applies to the first chunk and to each gap between chunks.
+        Streams are not hedged. The caller validates the joined text with
+        validate_message once the stream ends.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {self.model_name}")
+        self._ensure_client()
+        
+        prompt = self._build_prompt(topic, min_length, max_length)
+        outcome = None  # None means abandoned by the caller
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(prompt, stream=True), timeout=self.request_timeout
+                )
+                chunks = response.__aiter__()
+                first = True
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.request_timeout)
+                    except StopAsyncIteration:
+                        break
+                    if first:
+                        metrics.observe('gemini_first_token_seconds', time.perf_counter() - started, model=self.model_name)
+                        first = False
+                    try:
+                        text = chunk.text
+                    except ValueError:  # A chunk without text parts, e.g. only a finish reason
+                        continue
+                    if text:
+                        yield text
+                metrics.observe('gemini_stream_seconds', time.perf_counter() - started, model=self.model_name)
+            outcome = 'success'
+        except BACKEND_FAILURES:
+            outcome = 'failure'
+            raise
+        except Exception:
+            outcome = 'success'  # The API answered; the request was at fault
+            raise
+        finally:
+            if outcome == 'success':
+                self.breaker.record_success()
+            elif outcome == 'failure':
+                self.breaker.record_failure()
             else:
-                logger.error("Empty response from AI service")
-                return None
-                
+                self.breaker.record_cancelled()
+    
+    async def request_variants(self, topic: str, count: int, min_length: int = 300, max_length: int = 400) -> List[Variant]:
+        """Generate up to count variants in a single request, raising API errors.
+        
+        Used by callers that need to tell quota and server errors apart.
+        """
+        if count <= 1:
+            prompt = self._build_prompt(topic, min_length, max_length)
+            response = await self._generate_content_async(prompt)
+            message = self._extract_message(response, min_length, max_length)
+            return [Variant(message)] if message else []
+        
+        count = min(count, len(VARIANT_TONES))
+        prompt = self._build_variants_prompt(topic, count, min_length, max_length)
+        response = await self._generate_content_async(
+            prompt, generation_config={"response_mime_type": "application/json"}
+        )
+        return self._extract_variants(response, count, min_length, max_length)
+    
+    async def generate_variants_async(self, topic: str, count: int, min_length: int = 300, max_length: int = 400) -> List[Variant]:
+        """Generate up to count variants of a message in a single request."""
+        try:
+            return await self.request_variants(topic, count, min_length, max_length)
+        
+        except asyncio.TimeoutError:
+            logger.error("Timed out generating variants after %ss", self.request_timeout)
+            return []
         except Exception as e:
-            logger.error(f"Error generating message: {str(e)}")
-            return None
+            logger.error("Error generating variants: %s", e)
+            return []
     
     def is_appropriate_topic(self, topic: str) -> bool:
         """Check if the topic is appropriate for content generation."""
-        # Simple content filtering - can be expanded
-        inappropriate_keywords = [
-            'hate', 'violence', 'illegal', 'harmful', 'dangerous',
-            'porn', 'sex', 'drug', 'weapon', 'bomb', 'terror'
-        ]
-        
-        topic_lower = topic.lower()
-        return not any(keyword in topic_lower for keyword in inappropriate_keywords)
+        return self.topic_filter.is_allowed(topic)
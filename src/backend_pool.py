@@ -0,0 +1,282 @@
+import time
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, List, Tuple
+
+from google.api_core import exceptions as google_exceptions
+
+from ai_service import AIService
+from coordination import Coordinator, quota_buckets
+from database import DatabaseManager
+from message_cache import Variant
+from metrics import metrics
+from resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the backend's quota is used up
+QUOTA_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+# Errors worth retrying on another backend (the service's circuit breaker
+# counts them)
+TRANSIENT_ERRORS = (
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
+def parse_backends(spec: str, default_key: str, default_model: str,
+                   default_per_minute: int, default_per_day: int) -> List[Tuple[str, str, int, int]]:
+    """Parse GOOGLE_AI_BACKENDS into (api_key, model, requests_per_minute, requests_per_day).
+    
+    The spec is a comma-separated list of key:model[:per_minute[:per_day]]
+    entries. An empty key uses GOOGLE_AI_API_KEY. An empty spec gives the
+    single default backend.
+    """
+    backends = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = entry.split(':')
+        api_key = parts[0] or default_key
+        model = parts[1] if len(parts) > 1 and parts[1] else default_model
+        per_minute = int(parts[2]) if len(parts) > 2 and parts[2] else default_per_minute
+        per_day = int(parts[3]) if len(parts) > 3 and parts[3] else default_per_day
+        backends.append((api_key, model, per_minute, per_day))
+    
+    return backends or [(default_key, default_model, default_per_minute, default_per_day)]
+
+class Backend:
+    """One (API key, model) pair with its own quota and health state."""
+    
+    def __init__(self, service: AIService, requests_per_minute: int, requests_per_day: int):
+        self.service = service
+        self.requests_per_minute = requests_per_minute
+        self.requests_per_day = requests_per_day
+        
+        # Stable name for accounting that does not reveal the key
+        key_hash = hashlib.sha256(service.api_key.encode()).hexdigest()[:8]
+        self.name = f"{service.model_name}:{key_hash}"
+        self.quota = quota_buckets(f"backend:{self.name}", requests_per_minute, requests_per_day)
+        
+        self.cooldown_until = 0.0
+
+class BackendPool:
+    """Spreads generation across several (key, model) backends.
+    
+    Requests go to the backend with the most remaining quota headroom. Quota
+    errors put a backend in cooldown immediately and fail over to the next one.
+    Server errors fail over too; backends whose circuit breaker is open are
+    skipped. Hedge requests are only allowed on backends with at least
+    hedge_min_headroom of their quota left, and count against it. Headroom is
+    ranked from this process's own requests; each call also takes a token
+    from the backend's quota buckets shared through the coordinator, so the
+    quota holds across bot processes.
+    """
+    
+    def __init__(self, backends: List[Backend], db: DatabaseManager, coordinator: Coordinator,
+                 cooldown_seconds: float = 60.0, hedge_min_headroom: float = 0.2):
+        self.backends = backends
+        self.db = db
+        self.coordinator = coordinator
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_min_headroom = hedge_min_headroom
+        self.failovers = 0
+        self.min_latency_samples = 10
+        
+        for backend in backends:
+            backend.service.reserve_hedge = lambda backend=backend: self._reserve_hedge(backend)
+    
+    @property
+    def requests_per_minute(self) -> int:
+        return sum(backend.requests_per_minute for backend in self.backends)
+    
+    @property
+    def requests_per_day(self) -> int:
+        return sum(backend.requests_per_day for backend in self.backends)
+    
+    def _headroom(self, backend: Backend) -> float:
+        """Get the fraction of a backend's tighter limit still available."""
+        minute_left, day_left = self.db.get_backend_limiter(backend.name).remaining(
+            backend.requests_per_minute, backend.requests_per_day
+        )
+        return min(minute_left / max(1, backend.requests_per_minute), day_left / max(1, backend.requests_per_day))
+    
+    def _candidates(self) -> List[Backend]:
+        """Get usable backends, most headroom first (configuration order breaks ties)."""
+        now = time.monotonic()
+        ranked = []
+        for index, backend in enumerate(self.backends):
+            if backend.cooldown_until > now or not backend.service.breaker.available():
+                continue
+            headroom = self._headroom(backend)
+            if headroom > 0:
+                ranked.append((-headroom, index, backend))
+        return [backend for _, _, backend in sorted(ranked, key=lambda item: item[:2])]
+    
+    def expected_latency(self) -> float:
+        """Get the median latency of completed Gemini calls on the fastest backend (0 until enough samples)."""
+        latencies = []
+        for backend in self.backends:
+            histogram = metrics.get_histogram('gemini_request_seconds', model=backend.service.model_name, outcome='ok')
+            if histogram is not None and histogram.count >= self.min_latency_samples:
+                latencies.append(histogram.quantile(0.5))
+        return min(latencies, default=0.0)
+    
+    async def _reserve_hedge(self, backend: Backend) -> bool:
+        """Record a hedge request against a backend if its quota allows one."""
+        if self._headroom(backend) < self.hedge_min_headroom:
+            return False
+        if await self.coordinator.acquire(backend.quota) > 0:
+            return False
+        await self.db.record_api_request(success=True, backend=backend.name)
+        return True
+    
+    def _raise_if_all_failing(self, breaker_rejections: int = 0, calls: int = 0):
+        """Raise CircuitOpenError if every backend's breaker is open or rejected our calls."""
+        if calls and breaker_rejections == calls:
+            raise CircuitOpenError("Every API backend tried rejected the call")
+        if not any(backend.service.breaker.available() for backend in self.backends):
+            raise CircuitOpenError("All API backends are failing")
+    
+    def _cool_down(self, backend: Backend, reason: str):
+        backend.cooldown_until = time.monotonic() + self.cooldown_seconds
+        logger.warning("Backend %s cooling down for %ss: %s", backend.name, self.cooldown_seconds, reason)
+    
+    async def generate_variants_async(self, topic: str, count: int, min_length: int = 300,
+                                      max_length: int = 400) -> List[Variant]:
+        """Generate message variants on the best available backend, failing over on errors.
+        
+        Raises CircuitOpenError when every backend's circuit breaker is open,
+        or rejected the call.
+        """
+        candidates = self._candidates()
+        if not candidates:
+            self._raise_if_all_failing()
+            logger.error("No API backend available")
+            return []
+        
+        # A breaker may open between ranking and the call, e.g. after another
+        # request's failure; such rejections fail over like transient errors
+        calls = breaker_rejections = 0
+        for attempt, backend in enumerate(candidates):
+            if attempt:
+                self.failovers += 1
+                logger.info("Failing over to backend %s", backend.name)
+            
+            # Other bot processes may have used up this backend's quota
+            if await self.coordinator.acquire(backend.quota) > 0:
+                metrics.inc('backend_quota_skips_total', backend=backend.name)
+                logger.info("Backend %s quota used up by other instances", backend.name)
+                continue
+            
+            # Record the API request attempt
+            await self.db.record_api_request(success=False, backend=backend.name)  # Start as failed, update on success
+            
+            calls += 1
+            try:
+                messages = await backend.service.request_variants(topic, count, min_length, max_length)
+            except CircuitOpenError as e:
+                breaker_rejections += 1
+                logger.info("Backend %s rejected the call: %s", backend.name, e)
+                continue
+            except QUOTA_ERRORS as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='quota')
+                self._cool_down(backend, f"quota exhausted ({str(e)})")
+                continue
+            except TRANSIENT_ERRORS as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='transient')
+                logger.error("Error from backend %s: %s", backend.name, str(e) or type(e).__name__)
+                continue
+            except Exception as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='other')
+                logger.error("Error generating message on backend %s: %s", backend.name, e)
+                return []
+            
+            if messages:
+                # Update to successful API request
+                await self.db.record_api_request(success=True, backend=backend.name)
+            return messages
+        
+        self._raise_if_all_failing(breaker_rejections, calls)
+        return []
+    
+    async def stream_message_async(self, topic: str, min_length: int = 300,
+                                   max_length: int = 400) -> AsyncIterator[str]:
+        """Stream a message from the best available backend as text chunks.
+        
+        Fails over like generate_variants_async until the first chunk arrives;
+        errors after that are raised to the caller. Raises CircuitOpenError
+        when every backend's circuit breaker is open, or rejected the call.
+        """
+        candidates = self._candidates()
+        if not candidates:
+            self._raise_if_all_failing()
+            logger.error("No API backend available")
+            return
+        
+        calls = breaker_rejections = 0
+        for attempt, backend in enumerate(candidates):
+            if attempt:
+                self.failovers += 1
+                logger.info("Failing over to backend %s", backend.name)
+            
+            if await self.coordinator.acquire(backend.quota) > 0:
+                metrics.inc('backend_quota_skips_total', backend=backend.name)
+                logger.info("Backend %s quota used up by other instances", backend.name)
+                continue
+            
+            await self.db.record_api_request(success=False, backend=backend.name)
+            
+            calls += 1
+            stream = backend.service.stream_message(topic, min_length, max_length)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                return
+            except CircuitOpenError as e:
+                breaker_rejections += 1
+                logger.info("Backend %s rejected the call: %s", backend.name, e)
+                continue
+            except QUOTA_ERRORS as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='quota')
+                self._cool_down(backend, f"quota exhausted ({str(e)})")
+                continue
+            except TRANSIENT_ERRORS as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='transient')
+                logger.error("Error from backend %s: %s", backend.name, str(e) or type(e).__name__)
+                continue
+            except Exception as e:
+                metrics.inc('gemini_errors_total', backend=backend.name, kind='other')
+                logger.error("Error streaming message on backend %s: %s", backend.name, e)
+                return
+            
+            await self.db.record_api_request(success=True, backend=backend.name)
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+            return
+        
+        self._raise_if_all_failing(breaker_rejections, calls)
+    
+    def stats(self) -> List[dict]:
+        """Get per-backend headroom, health and hedging."""
+        now = time.monotonic()
+        return [
+            {
+                "backend": backend.name,
+                "headroom": round(self._headroom(backend), 3),
+                "consecutive_failures": backend.service.breaker.consecutive_failures,
+                "breaker_open": int(not backend.service.breaker.available()),
+                "breaker_times_opened": backend.service.breaker.times_opened,
+                "breaker_rejected": backend.service.breaker.rejected,
+                "cooldown_seconds": max(0.0, round(backend.cooldown_until - now, 1)),
+                **backend.service.hedge_policy.stats(),
+            }
+            for backend in self.backends
+        ]
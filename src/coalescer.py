@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+class _Flight:
+    """A shared in-flight call and the number of callers waiting on it."""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class RequestCoalescer:
+    """Single-flight coalescing: concurrent callers with the same key share one call.
+    
+    The shared call is only cancelled once every waiter has gone away, so one
+    user cancelling (e.g. by typing further) does not abort it for the others.
+    A waiter that times out leaves the call running, so its result can still
+    be used (e.g. cached) and joined by later callers.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.timed_out = 0
+    
+    def is_inflight(self, key: str) -> bool:
+        """Check if a call for the key is currently running."""
+        return key in self._inflight
+    
+    def _forget(self, key: str, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+    
+    async def run(self, key: str, factory: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """Run factory() for the key, or wait on the call already in flight.
+        
+        Raises asyncio.TimeoutError if the call takes longer than timeout
+        seconds; the call itself keeps running.
+        """
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._forget(key, flight))
+            self._inflight[key] = flight
+            self.calls += 1
+        else:
+            self.coalesced += 1
+            logger.debug("Coalesced request for key '%s'", key)
+        
+        flight.waiters += 1
+        abandoned = True
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        except asyncio.TimeoutError:
+            if not flight.task.done():
+                abandoned = False
+                self.timed_out += 1
+            raise
+        finally:
+            flight.waiters -= 1
+            if abandoned and flight.waiters == 0 and not flight.task.done():
+                # Last waiter left; new callers must start a fresh call
+                self._forget(key, flight)
+                flight.task.cancel()
+    
+    def stats(self) -> dict:
+        """Get call counters."""
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "timed_out": self.timed_out,
+            "inflight": len(self._inflight),
+        }
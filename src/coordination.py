@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence
+
+from metrics import metrics
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for COORDINATION_BACKEND=redis
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+class Bucket(NamedTuple):
+    """A token bucket holding up to capacity tokens, refilled over period seconds."""
+    name: str
+    capacity: float
+    period: float
+
+def quota_buckets(name: str, requests_per_minute: int, requests_per_day: int) -> List[Bucket]:
+    """Get the per-minute and per-day buckets enforcing an API quota."""
+    return [
+        Bucket(f"{name}:minute", max(1, requests_per_minute), 60.0),
+        Bucket(f"{name}:day", max(1, requests_per_day), 24 * 60 * 60.0),
+    ]
+
+def _take(buckets: Sequence[Bucket], levels: List[float]) -> float:
+    """Take a token from every bucket, or get the seconds until all have one."""
+    wait = max(
+        ((1 - tokens) * bucket.period / bucket.capacity
+         for bucket, tokens in zip(buckets, levels) if tokens < 1),
+        default=0.0
+    )
+    if wait == 0.0:
+        for index in range(len(levels)):
+            levels[index] -= 1
+    return wait
+
+class Coordinator(ABC):
+    """Quota, generation leases and cached messages shared by every bot process.
+    
+    Token buckets keep the Gemini quota global when several instances run
+    (blue/green deploys, sharding), and leases let one instance generate a
+    topic while the others wait for its result in the shared message cache.
+    """
+    
+    def __init__(self):
+        # Identifies this process as a lease owner
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    
+    async def start(self):
+        """Connect to the backend. Must be called from the running event loop."""
+    
+    async def close(self):
+        """Release the backend connection."""
+    
+    @abstractmethod
+    async def acquire(self, buckets: Sequence[Bucket]) -> float:
+        """Take one token from every bucket, atomically.
+        
+        Returns 0 if the tokens were taken, otherwise the seconds until they
+        could be (nothing is taken then).
+        """
+    
+    @abstractmethod
+    async def try_lock(self, key: str, ttl: float) -> bool:
+        """Take the lease on key for ttl seconds unless another owner holds it."""
+    
+    @abstractmethod
+    async def unlock(self, key: str):
+        """Release a lease held by this process."""
+    
+    @abstractmethod
+    async def is_locked(self, key: str) -> bool:
+        """Check if any owner holds the lease on key."""
+    
+    @abstractmethod
+    async def get_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        """Get messages any process cached under cache_key, if not expired."""
+    
+    @abstractmethod
+    async def put_messages(self, cache_key: str, messages: List[str], ttl: float):
+        """Share messages cached under cache_key with the other processes."""
+
+class SQLiteCoordinator(Coordinator):
+    """Coordinator over the bot's SQLite database, for instances on one host.
+    
+    Bucket updates run in BEGIN IMMEDIATE transactions, so concurrent
+    processes serialize on SQLite's write lock and can never both take the
+    last token. Uses its own connection and thread so quota checks don't queue
+    behind the database writer.
+    """
+    
+    def __init__(self, db_path: str):
+        super().__init__()
+        self.db_path = db_path
+        # Autocommit; transactions are opened explicitly
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='coordination')
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        with metrics.timer('coordination_seconds', op=func.__name__.lstrip('_')):
+            return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+    
+    def _acquire(self, buckets: Sequence[Bucket]) -> float:
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            levels = []
+            for bucket in buckets:
+                row = conn.execute('''
+                    SELECT tokens, updated_at FROM coordination_buckets WHERE name = ?
+                ''', (bucket.name,)).fetchone()
+                if row is None:
+                    levels.append(float(bucket.capacity))
+                else:
+                    refill = max(0.0, now - row[1]) * bucket.capacity / bucket.period
+                    levels.append(min(bucket.capacity, row[0] + refill))
+            
+            wait = _take(buckets, levels)
+            if wait == 0.0:
+                conn.executemany('''
+                    INSERT INTO coordination_buckets (name, tokens, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at
+                ''', [(bucket.name, tokens, now) for bucket, tokens in zip(buckets, levels)])
+            conn.execute('COMMIT')
+            return wait
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    async def acquire(self, buckets: Sequence[Bucket]) -> float:
+        return await self._run(self._acquire, buckets)
+    
+    def _try_lock(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        # Takes a free or expired lease in one atomic statement
+        cursor = self._conn.execute('''
+            INSERT INTO coordination_leases (key, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE coordination_leases.expires_at <= ?
+        ''', (key, self.owner, now + ttl, now))
+        return cursor.rowcount == 1
+    
+    async def try_lock(self, key: str, ttl: float) -> bool:
+        return await self._run(self._try_lock, key, ttl)
+    
+    def _unlock(self, key: str):
+        # Also clears leases left behind by crashed processes
+        self._conn.execute('''
+            DELETE FROM coordination_leases
+            WHERE (key = ? AND owner = ?) OR expires_at <= ?
+        ''', (key, self.owner, time.time()))
+    
+    async def unlock(self, key: str):
+        await self._run(self._unlock, key)
+    
+    def _is_locked(self, key: str) -> bool:
+        row = self._conn.execute('''
+            SELECT 1 FROM coordination_leases WHERE key = ? AND expires_at > ?
+        ''', (key, time.time())).fetchone()
+        return row is not None
+    
+    async def is_locked(self, key: str) -> bool:
+        return await self._run(self._is_locked, key)
+    
+    def _get_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        row = self._conn.execute('''
+            SELECT messages FROM message_cache WHERE cache_key = ? AND created_at > ?
+        ''', (cache_key, int(time.time() - max_age_seconds))).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    async def get_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        return await self._run(self._get_messages, cache_key, max_age_seconds)
+    
+    async def put_messages(self, cache_key: str, messages: List[str], ttl: float):
+        # MessageCache already stores its entries in this database
+        pass
+
+# KEYS are bucket names; ARGV holds capacity and period per bucket. Uses the
+# server clock so instances on different hosts agree on refills.
+_ACQUIRE_SCRIPT = '''
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local period = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = capacity
+    if state[1] then
+        tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * capacity / period)
+    end
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) * period / capacity)
+    end
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', levels[i] - 1, 'updated_at', now)
+        redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 * i])) * 2)
+    end
+end
+return tostring(wait)
+'''
+
+_UNLOCK_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+class RedisCoordinator(Coordinator):
+    """Coordinator over Redis (or a Redis-compatible server), for instances on several hosts.
+    
+    Cached messages are copied into Redis with the cache TTL, so an instance
+    waiting on another host's generation lease can read its result.
+    """
+    
+    def __init__(self, url: str, prefix: str = 'vibebot:'):
+        super().__init__()
+        if redis_asyncio is None:
+            raise RuntimeError("COORDINATION_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+    
+    async def start(self):
+        if self._client is None:
+            self._client = redis_asyncio.from_url(self.url, decode_responses=True)
+            self._acquire_script = self._client.register_script(_ACQUIRE_SCRIPT)
+            self._unlock_script = self._client.register_script(_UNLOCK_SCRIPT)
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def acquire(self, buckets: Sequence[Bucket]) -> float:
+        await self.start()
+        args = [value for bucket in buckets for value in (bucket.capacity, bucket.period)]
+        with metrics.timer('coordination_seconds', op='acquire'):
+            wait = await self._acquire_script(keys=[self.prefix + bucket.name for bucket in buckets], args=args)
+        return float(wait)
+    
+    async def try_lock(self, key: str, ttl: float) -> bool:
+        await self.start()
+        with metrics.timer('coordination_seconds', op='try_lock'):
+            return bool(await self._client.set(self.prefix + key, self.owner, nx=True, px=max(1, int(ttl * 1000))))
+    
+    async def unlock(self, key: str):
+        await self.start()
+        with metrics.timer('coordination_seconds', op='unlock'):
+            await self._unlock_script(keys=[self.prefix + key], args=[self.owner])
+    
+    async def is_locked(self, key: str) -> bool:
+        await self.start()
+        with metrics.timer('coordination_seconds', op='is_locked'):
+            return bool(await self._client.exists(self.prefix + key))
+    
+    async def get_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        # Entries expire in Redis itself after the TTL they were put with
+        await self.start()
+        with metrics.timer('coordination_seconds', op='get_messages'):
+            value = await self._client.get(f"{self.prefix}messages:{cache_key}")
+        return json.loads(value) if value else None
+    
+    async def put_messages(self, cache_key: str, messages: List[str], ttl: float):
+        await self.start()
+        with metrics.timer('coordination_seconds', op='put_messages'):
+            await self._client.set(
+                f"{self.prefix}messages:{cache_key}", json.dumps(messages), px=max(1, int(ttl * 1000))
+            )
+
+def create_coordinator(backend: str, db_path: str, redis_url: Optional[str] = None) -> Coordinator:
+    """Create the coordinator configured by COORDINATION_BACKEND."""
+    if backend == 'sqlite':
+        return SQLiteCoordinator(db_path)
+    if backend == 'redis':
+        return RedisCoordinator(redis_url or 'redis://localhost:6379/0')
+    raise ValueError("COORDINATION_BACKEND must be 'sqlite' or 'redis'")
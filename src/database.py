@@ -1,140 +1,677 @@
 import os
+import time
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Optional, Tuple
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 import logging
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from rate_limiter import SlidingWindowRateLimiter
 
 logger = logging.getLogger(__name__)
 
+def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, column_type: str):
+    """Add a column to an existing table if it is missing."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in (row[1] for row in cursor.fetchall()):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+def _migrate_initial_schema(cursor: sqlite3.Cursor):
+    """Initial schema with ISO-8601 text timestamps."""
+    # Databases created before versioning are at user_version 0 and may have
+    # any of these tables already, so everything here is idempotent
+    
+    # Create API rate limiting table (project-level)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            success BOOLEAN
+        )
+    ''')
+    
+    # Create usage logs table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            query TEXT,
+            response_length INTEGER,
+            timestamp TEXT,
+            success BOOLEAN
+        )
+    ''')
+    
+    # Create per-user scheduling limits table (alongside usage_logs)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_limits (
+            user_id INTEGER PRIMARY KEY,
+            daily_soft_cap INTEGER,
+            weight REAL
+        )
+    ''')
+    
+    # Create generated message cache table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_cache (
+            cache_key TEXT PRIMARY KEY,
+            topic TEXT,
+            messages TEXT,
+            created_at TEXT
+        )
+    ''')
+    
+    # Per-backend accounting for the API key/model pool
+    _ensure_column(cursor, 'api_requests', 'backend', 'TEXT')
+
+def _migrate_epoch_timestamps(cursor: sqlite3.Cursor):
+    """Integer epoch timestamps."""
+    # SQLite cannot change a column's type, so each table is rebuilt. Old
+    # indexes go with the dropped tables and are recreated by the next migration.
+    cursor.execute('''
+        CREATE TABLE api_requests_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL,
+            success INTEGER NOT NULL,
+            backend TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO api_requests_new (id, timestamp, success, backend) 
+        SELECT id, CAST(strftime('%s', timestamp) AS INTEGER), COALESCE(success, 0), backend 
+        FROM api_requests WHERE strftime('%s', timestamp) IS NOT NULL
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE usage_logs_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            query TEXT,
+            response_length INTEGER,
+            timestamp INTEGER NOT NULL,
+            success INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO usage_logs_new (id, user_id, query, response_length, timestamp, success) 
+        SELECT id, user_id, query, response_length, CAST(strftime('%s', timestamp) AS INTEGER), COALESCE(success, 0) 
+        FROM usage_logs WHERE strftime('%s', timestamp) IS NOT NULL
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE message_cache_new (
+            cache_key TEXT PRIMARY KEY,
+            topic TEXT,
+            messages TEXT,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO message_cache_new (cache_key, topic, messages, created_at) 
+        SELECT cache_key, topic, messages, CAST(strftime('%s', created_at) AS INTEGER) 
+        FROM message_cache WHERE strftime('%s', created_at) IS NOT NULL
+    ''')
+    
+    for table in ('api_requests', 'usage_logs', 'message_cache'):
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+def _migrate_indexes(cursor: sqlite3.Cursor):
+    """Covering and partial indexes for rate limiting, scheduling and cleanup."""
+    # Retention deletes scan by time alone
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_api_requests_timestamp 
+        ON api_requests(timestamp)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_usage_logs_timestamp 
+        ON usage_logs(timestamp)
+    ''')
+    
+    # Rate limiter rebuild reads (timestamp, backend) of successful requests only
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_api_requests_success_timestamp 
+        ON api_requests(timestamp, backend) WHERE success = 1
+    ''')
+    
+    # Scheduler usage counts group successful requests by user. This replaces
+    # idx_usage_logs_user_timestamp, which the planner preferred for the GROUP BY
+    # even though it has to visit every user
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_usage_logs_success_timestamp 
+        ON usage_logs(timestamp, user_id) WHERE success = 1
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_message_cache_created_at 
+        ON message_cache(created_at)
+    ''')
+
+def _migrate_daily_rollups(cursor: sqlite3.Cursor):
+    """Daily per-user usage rollups."""
+    # Sums rather than rates so partial days from several retention batches add up
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_daily_rollups (
+            day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            successes INTEGER NOT NULL,
+            total_response_length INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        )
+    ''')
+
+def _migrate_coordination(cursor: sqlite3.Cursor):
+    """Token buckets and leases shared between bot processes."""
+    # Used by coordination.SQLiteCoordinator
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS coordination_buckets (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS coordination_leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_coordination_leases_expires_at 
+        ON coordination_leases(expires_at)
+    ''')
+
+def _migrate_user_topics_index(cursor: sqlite3.Cursor):
+    """Per-user index for recent and frequent topics."""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_usage_logs_success_user_timestamp 
+        ON usage_logs(user_id, timestamp) WHERE success = 1
+    ''')
+
+def _migrate_user_admissions(cursor: sqlite3.Cursor):
+    """Generations admitted by the scheduler, per user and UTC day."""
+    # usage_logs also holds cache hits, which never took a generation
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_admissions (
+            day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            admitted INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        )
+    ''')
+
+# Schema migrations in order; a database's PRAGMA user_version is the number
+# already applied. Append new migrations, never edit or reorder applied ones.
+MIGRATIONS = [
+    _migrate_initial_schema,
+    _migrate_epoch_timestamps,
+    _migrate_indexes,
+    _migrate_daily_rollups,
+    _migrate_coordination,
+    _migrate_user_topics_index,
+    _migrate_user_admissions,
+]
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def _to_epoch(moment: datetime) -> int:
+    """Convert a naive UTC datetime to integer epoch seconds."""
+    return int(moment.replace(tzinfo=timezone.utc).timestamp())
+
 class DatabaseManager:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, write_batch_size: int = 200):
         self.db_path = db_path
+        self.write_batch_size = write_batch_size
+        
+        # One long-lived connection, only ever used from the database thread
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = self._connect()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
         self.init_database()
-        self._request_times = []  # In-memory tracking for API rate limits
-        self._lock = asyncio.Lock()
+        
+        # In-memory tracking for API rate limits, rebuilt from api_requests
+        self.rate_limiter = SlidingWindowRateLimiter()
+        self.backend_limiters: Dict[str, SlidingWindowRateLimiter] = {}
+        self._load_rate_limiter()
+        
+        # Write-behind queue of (sql, params), drained in batches by _writer_loop
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
     
-    def init_database(self):
-        """Initialize database and create tables if they don't exist."""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+    def _connect(self) -> sqlite3.Connection:
+        """Open the shared connection configured for WAL."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+    
+    async def _run(self, func, *args):
+        """Run a function on the database thread."""
+        loop = asyncio.get_running_loop()
+        # Includes time spent waiting for the database thread
+        with metrics.timer('db_operation_seconds', op=func.__name__.lstrip('_')):
+            return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def start(self):
+        """Start the background writer. Must be called from the running event loop."""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer_loop())
+    
+    async def close(self):
+        """Flush queued writes and close the connection."""
+        if self._writer_task is not None:
+            await self._write_queue.join()
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Create API rate limiting table (project-level)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS api_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT,
-                    success BOOLEAN
-                )
-            ''')
-            
-            # Create usage logs table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS usage_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    query TEXT,
-                    response_length INTEGER,
-                    timestamp TEXT,
-                    success BOOLEAN
-                )
-            ''')
-            
-            # Create index for faster queries
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_api_requests_timestamp 
-                ON api_requests(timestamp)
-            ''')
-            
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_usage_logs_user_timestamp 
-                ON usage_logs(user_id, timestamp)
-            ''')
+        # Flush anything queued while the writer was not running
+        pending = []
+        while not self._write_queue.empty():
+            pending.append(self._write_queue.get_nowait())
+            self._write_queue.task_done()
+        if pending:
+            await self._run(self._execute_batch, pending)
+            self._resolve_flushes(pending)
+        
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        logger.info("Database connection closed")
+    
+    def _enqueue_write(self, sql: str, params: tuple):
+        """Queue a write for the background writer without blocking."""
+        self._write_queue.put_nowait((sql, params))
+    
+    def queue_depth(self) -> int:
+        """Get the number of writes waiting for the background writer."""
+        return self._write_queue.qsize()
+    
+    async def flush(self):
+        """Wait until every write queued so far is committed."""
+        if self._writer_task is None:
+            return
+        # A marker entry (None, future), resolved once its batch is written
+        committed = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((None, committed))
+        await committed
+    
+    def _execute_batch(self, batch: List[Tuple[str, tuple]]):
+        """Execute queued writes in a single transaction."""
+        with self._conn as conn:
+            for sql, params in batch:
+                if sql is not None:
+                    conn.execute(sql, params)
+    
+    def _resolve_flushes(self, batch: List[Tuple[str, tuple]]):
+        for sql, committed in batch:
+            if sql is None and not committed.done():
+                committed.set_result(None)
+    
+    async def _writer_loop(self):
+        """Drain the write queue in batched transactions."""
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < self.write_batch_size and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
             
+            try:
+                await self._run(self._execute_batch, batch)
+            except Exception as e:
+                logger.error("Error writing batch of %s records: %s", len(batch), e)
+            finally:
+                self._resolve_flushes(batch)
+                for _ in batch:
+                    self._write_queue.task_done()
+    
+    def init_database(self):
+        """Create the schema or migrate an existing database to the latest version."""
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise RuntimeError(f"Database schema version {version} is newer than this bot supports ({len(MIGRATIONS)})")
+        
+        for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Migrating database to schema version %s: %s", version, migration.__doc__)
+            self._apply_migration(version, migration)
+    
+    def _apply_migration(self, version: int, migration):
+        """Run one migration and bump user_version in a single transaction."""
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
             conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _load_rate_limiter(self):
+        """Rebuild the in-memory rate limiters from the last day of successful requests."""
+        day_ago = int(time.time()) - SECONDS_PER_DAY
+        
+        # Index-only scan of idx_api_requests_success_timestamp, already in time order
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT timestamp, backend FROM api_requests 
+            WHERE timestamp > ? AND success = 1 
+            ORDER BY timestamp
+        ''', (day_ago,))
+        
+        for timestamp, backend in cursor.fetchall():
+            self.rate_limiter.record(timestamp)
+            if backend:
+                self.get_backend_limiter(backend).record(timestamp)
+    
+    def get_backend_limiter(self, backend: str) -> SlidingWindowRateLimiter:
+        """Get the rate limiter tracking a single API backend."""
+        if backend not in self.backend_limiters:
+            self.backend_limiters[backend] = SlidingWindowRateLimiter()
+        return self.backend_limiters[backend]
     
     async def check_api_rate_limit(self, requests_per_minute: int, requests_per_day: int) -> Tuple[bool, str]:
         """Check if API rate limits are exceeded (project-level)."""
-        async with self._lock:
-            now = datetime.utcnow()
-            minute_ago = now - timedelta(minutes=1)
-            day_ago = now - timedelta(days=1)
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check per-minute limit
-                cursor.execute('''
-                    SELECT COUNT(*) FROM api_requests 
-                    WHERE timestamp > ? AND success = 1
-                ''', (minute_ago.isoformat(),))
-                
-                minute_count = cursor.fetchone()[0]
-                
-                if minute_count >= requests_per_minute:
-                    return False, f"API rate limit exceeded: {requests_per_minute} requests per minute. Please try again later."
-                
-                # Check per-day limit
-                cursor.execute('''
-                    SELECT COUNT(*) FROM api_requests 
-                    WHERE timestamp > ? AND success = 1
-                ''', (day_ago.isoformat(),))
-                
-                day_count = cursor.fetchone()[0]
-                
-                if day_count >= requests_per_day:
-                    return False, f"Daily API limit exceeded: {requests_per_day} requests per day. Please try again tomorrow."
-                
-                return True, ""
-    
-    async def record_api_request(self, success: bool = True):
+        return self.rate_limiter.check(requests_per_minute, requests_per_day)
+    
+    async def record_api_request(self, success: bool = True, backend: Optional[str] = None):
         """Record an API request for rate limiting."""
-        async with self._lock:
-            now = datetime.utcnow()
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO api_requests (timestamp, success) 
-                    VALUES (?, ?)
-                ''', (now.isoformat(), success))
-                conn.commit()
+        now = time.time()
+        
+        # Count it in memory right away, persist in the background
+        if success:
+            self.rate_limiter.record(now)
+            if backend:
+                self.get_backend_limiter(backend).record(now)
+        
+        self._enqueue_write('''
+            INSERT INTO api_requests (timestamp, success, backend) 
+            VALUES (?, ?, ?)
+        ''', (int(now), int(success), backend))
     
     def log_usage(self, user_id: int, query: str, response_length: int, success: bool):
         """Log usage for analytics."""
-        now = datetime.utcnow()
+        self._enqueue_write('''
+            INSERT INTO usage_logs (user_id, query, response_length, timestamp, success) 
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, query, response_length, int(time.time()), int(success)))
+    
+    def _get_user_limits(self) -> Dict[int, dict]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT user_id, daily_soft_cap, weight FROM user_limits
+        ''')
+        return {
+            row[0]: {"daily_soft_cap": row[1], "weight": row[2]}
+            for row in cursor.fetchall()
+        }
+    
+    async def get_user_limits(self) -> Dict[int, dict]:
+        """Get per-user soft caps and scheduling weights."""
+        return await self._run(self._get_user_limits)
+    
+    def record_admission(self, user_id: int):
+        """Count a generation the scheduler admitted for a user today."""
+        now = int(time.time())
+        self._enqueue_write('''
+            INSERT INTO user_admissions (day, user_id, admitted) VALUES (?, ?, 1) 
+            ON CONFLICT (day, user_id) DO UPDATE SET admitted = admitted + 1
+        ''', (now - now % SECONDS_PER_DAY, user_id))
+    
+    def _get_user_usage_counts(self, since: datetime) -> Dict[int, int]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT user_id, SUM(admitted) FROM user_admissions 
+            WHERE day >= ? 
+            GROUP BY user_id
+        ''', (_to_epoch(since) // SECONDS_PER_DAY * SECONDS_PER_DAY,))
+        return {row[0]: row[1] for row in cursor.fetchall()}
+    
+    async def get_user_usage_counts(self, since: datetime) -> Dict[int, int]:
+        """Get admitted generation counts per user since the given day."""
+        return await self._run(self._get_user_usage_counts, since)
+    
+    def _get_trending_topics(self, since: int, limit: int) -> List[Tuple[str, int]]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT query, COUNT(DISTINCT user_id) AS users FROM usage_logs 
+            WHERE timestamp > ? AND success = 1 AND query != '' 
+            GROUP BY lower(query) 
+            HAVING users > 1 
+            ORDER BY users DESC, COUNT(*) DESC 
+            LIMIT ?
+        ''', (since, limit))
+        return cursor.fetchall()
+    
+    async def get_trending_topics(self, since: datetime, limit: int = 20) -> List[Tuple[str, int]]:
+        """Get (topic, distinct users) for topics asked by more than one user since the given time."""
+        return await self._run(self._get_trending_topics, _to_epoch(since), limit)
+    
+    def _get_frequent_user_topics(self, since: int, per_user: int, min_count: int) -> List[Tuple[int, str, int]]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT user_id, topic, uses FROM (
+                SELECT user_id, query AS topic, COUNT(*) AS uses, 
+                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC, MAX(timestamp) DESC) AS position 
+                FROM usage_logs 
+                WHERE timestamp > ? AND success = 1 AND query != '' 
+                GROUP BY user_id, lower(query)
+            ) 
+            WHERE position <= ? AND uses >= ? 
+            ORDER BY uses DESC
+        ''', (since, per_user, min_count))
+        return cursor.fetchall()
+    
+    async def get_frequent_user_topics(self, since: datetime, per_user: int = 3,
+                                       min_count: int = 2) -> List[Tuple[int, str, int]]:
+        """Get (user_id, topic, uses) for each user's most repeated topics since the given time."""
+        return await self._run(self._get_frequent_user_topics, _to_epoch(since), per_user, min_count)
+    
+    def _get_recent_user_topics(self, user_id: int, limit: int) -> List[str]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT query FROM usage_logs 
+            WHERE user_id = ? AND success = 1 AND query != '' 
+            GROUP BY lower(query) 
+            ORDER BY MAX(timestamp) DESC 
+            LIMIT ?
+        ''', (user_id, limit))
+        return [row[0] for row in cursor.fetchall()]
+    
+    async def get_recent_user_topics(self, user_id: int, limit: int = 5) -> List[str]:
+        """Get a user's most recently requested distinct topics, newest first."""
+        return await self._run(self._get_recent_user_topics, user_id, limit)
+    
+    def _get_cached_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        cutoff = int(time.time() - max_age_seconds)
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO usage_logs (user_id, query, response_length, timestamp, success) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, query, response_length, now.isoformat(), success))
-            conn.commit()
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT messages FROM message_cache 
+            WHERE cache_key = ? AND created_at > ?
+        ''', (cache_key, cutoff))
+        
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else None
+    
+    async def get_cached_messages(self, cache_key: str, max_age_seconds: float) -> Optional[List[str]]:
+        """Get cached generated messages if present and not expired."""
+        return await self._run(self._get_cached_messages, cache_key, max_age_seconds)
     
-    def cleanup_old_records(self, days_to_keep: int = 30):
-        """Clean up old records to keep database size manageable."""
-        cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
+    def _get_cached_messages_many(self, cache_keys: List[str], max_age_seconds: float) -> Dict[str, List[str]]:
+        cutoff = int(time.time() - max_age_seconds)
         
-        with sqlite3.connect(self.db_path) as conn:
+        cursor = self._conn.cursor()
+        cursor.execute(f'''
+            SELECT cache_key, messages FROM message_cache 
+            WHERE cache_key IN ({", ".join("?" * len(cache_keys))}) AND created_at > ?
+        ''', (*cache_keys, cutoff))
+        return {cache_key: json.loads(messages) for cache_key, messages in cursor.fetchall()}
+    
+    async def get_cached_messages_many(self, cache_keys: List[str], max_age_seconds: float) -> Dict[str, List[str]]:
+        """Get unexpired cached messages for several cache keys in one query."""
+        if not cache_keys:
+            return {}
+        return await self._run(self._get_cached_messages_many, cache_keys, max_age_seconds)
+    
+    def _get_cached_topics(self, max_age_seconds: float) -> List[Tuple[str, str]]:
+        cursor = self._conn.cursor()
+        cursor.execute('''
+            SELECT cache_key, topic FROM message_cache 
+            WHERE created_at > ?
+        ''', (int(time.time() - max_age_seconds),))
+        return cursor.fetchall()
+    
+    async def get_cached_topics(self, max_age_seconds: float) -> List[Tuple[str, str]]:
+        """Get (cache_key, topic) of every unexpired cache entry."""
+        return await self._run(self._get_cached_topics, max_age_seconds)
+    
+    def store_cached_messages(self, cache_key: str, topic: str, messages: List[str]):
+        """Store generated messages in the cache table."""
+        self._enqueue_write('''
+            INSERT OR REPLACE INTO message_cache (cache_key, topic, messages, created_at) 
+            VALUES (?, ?, ?, ?)
+        ''', (cache_key, topic, json.dumps(messages), int(time.time())))
+    
+    def _evict_cached_messages(self, max_age_seconds: float, max_entries: int) -> int:
+        cutoff = int(time.time() - max_age_seconds)
+        
+        with self._conn as conn:
             cursor = conn.cursor()
-            
-            # Clean up API request records (keep shorter period for rate limiting)
-            api_cutoff = datetime.utcnow() - timedelta(days=7)  # Keep 1 week for rate limiting
             cursor.execute('''
-                DELETE FROM api_requests 
-                WHERE timestamp < ?
-            ''', (api_cutoff.isoformat(),))
+                DELETE FROM message_cache 
+                WHERE created_at < ?
+            ''', (cutoff,))
+            evicted = cursor.rowcount
             
-            # Clean up usage logs (keep them longer, maybe 90 days)
-            usage_cutoff = datetime.utcnow() - timedelta(days=90)
+            # Drop the oldest entries beyond the size limit
             cursor.execute('''
-                DELETE FROM usage_logs 
-                WHERE timestamp < ?
-            ''', (usage_cutoff.isoformat(),))
-            
-            conn.commit()
+                DELETE FROM message_cache 
+                WHERE cache_key IN (
+                    SELECT cache_key FROM message_cache 
+                    ORDER BY created_at DESC 
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (max_entries,))
+            evicted += cursor.rowcount
             
-            logger.info(f"Cleaned up records older than {days_to_keep} days")
+            return evicted
+    
+    async def evict_cached_messages(self, max_age_seconds: float, max_entries: int) -> int:
+        """Evict expired cache entries and trim the table to max_entries."""
+        return await self._run(self._evict_cached_messages, max_age_seconds, max_entries)
+    
+    def _purge_api_requests(self, cutoff: int, batch_size: int) -> int:
+        """Delete one batch of api_requests older than cutoff."""
+        with self._conn as conn:
+            cursor = conn.execute('''
+                DELETE FROM api_requests 
+                WHERE id IN (
+                    SELECT id FROM api_requests 
+                    WHERE timestamp < ? 
+                    ORDER BY timestamp LIMIT ?
+                )
+            ''', (cutoff, batch_size))
+            return cursor.rowcount
+    
+    def _purge_user_admissions(self, cutoff: int, batch_size: int) -> int:
+        """Delete admission counts of days before cutoff (a few rows per day)."""
+        with self._conn as conn:
+            cursor = conn.execute('''
+                DELETE FROM user_admissions WHERE day < ?
+            ''', (cutoff - cutoff % SECONDS_PER_DAY,))
+            return cursor.rowcount
+    
+    def _purge_usage_logs(self, cutoff: int, batch_size: int) -> int:
+        """Roll up and delete one batch of usage_logs older than cutoff."""
+        # Both statements select the same oldest rows, in one transaction
+        batch = '''
+            SELECT id FROM usage_logs 
+            WHERE timestamp < ? 
+            ORDER BY timestamp, id LIMIT ?
+        '''
+        with self._conn as conn:
+            conn.execute(f'''
+                INSERT INTO usage_daily_rollups (day, user_id, requests, successes, total_response_length) 
+                SELECT timestamp - timestamp % {SECONDS_PER_DAY}, user_id, COUNT(*), SUM(success), SUM(response_length) 
+                FROM usage_logs WHERE id IN ({batch}) 
+                GROUP BY 1, 2 
+                ON CONFLICT (day, user_id) DO UPDATE SET 
+                    requests = requests + excluded.requests, 
+                    successes = successes + excluded.successes, 
+                    total_response_length = total_response_length + excluded.total_response_length
+            ''', (cutoff, batch_size))
+            cursor = conn.execute(f'''
+                DELETE FROM usage_logs WHERE id IN ({batch})
+            ''', (cutoff, batch_size))
+            return cursor.rowcount
+    
+    async def cleanup_old_records(self, api_retention_days: float = 7, usage_retention_days: float = 90,
+                                  batch_size: int = 1000, time_budget: float = 5.0) -> Dict[str, int]:
+        """Delete expired records in small batches, rolling usage logs up by day first.
+        
+        Each batch is its own short transaction on the database thread, so
+        lookups and queued writes run in between. Stops after time_budget
+        seconds; whatever is left is picked up by the next run.
+        """
+        now = int(time.time())
+        purges = [
+            ('api_requests', self._purge_api_requests, now - int(api_retention_days * SECONDS_PER_DAY)),
+            ('user_admissions', self._purge_user_admissions, now - int(api_retention_days * SECONDS_PER_DAY)),
+            ('usage_logs', self._purge_usage_logs, now - int(usage_retention_days * SECONDS_PER_DAY)),
+        ]
+        deadline = time.monotonic() + time_budget
+        
+        deleted = {}
+        for table, purge, cutoff in purges:
+            deleted[table] = 0
+            while time.monotonic() < deadline:
+                count = await self._run(purge, cutoff, batch_size)
+                deleted[table] += count
+                metrics.inc('db_purged_rows_total', count, table=table)
+                if count < batch_size:
+                    break
+        
+        finished = time.monotonic() < deadline
+        logger.info("Retention removed %s%s", deleted, '' if finished else ' (time budget reached, continuing next run)')
+        return deleted
+    
+    def _get_daily_usage(self, since: int, user_id: Optional[int]) -> List[dict]:
+        # Days already purged come from the rollups, the rest from raw logs
+        user_filter = '' if user_id is None else 'AND user_id = ?'
+        user_params = () if user_id is None else (user_id,)
+        cursor = self._conn.cursor()
+        cursor.execute(f'''
+            SELECT day, user_id, SUM(requests), SUM(successes), SUM(total_response_length) FROM (
+                SELECT day, user_id, requests, successes, total_response_length 
+                FROM usage_daily_rollups WHERE day >= ? {user_filter} 
+                UNION ALL 
+                SELECT timestamp - timestamp % {SECONDS_PER_DAY}, user_id, COUNT(*), SUM(success), SUM(response_length) 
+                FROM usage_logs WHERE timestamp >= ? {user_filter} 
+                GROUP BY 1, 2
+            ) 
+            GROUP BY day, user_id 
+            ORDER BY day, user_id
+        ''', (since, *user_params, since, *user_params))
+        return [
+            {
+                "day": datetime.fromtimestamp(day, timezone.utc).date(),
+                "user_id": row_user_id,
+                "requests": requests,
+                "success_rate": successes / requests if requests else 0.0,
+                "average_length": total_length / successes if successes else 0.0,
+            }
+            for day, row_user_id, requests, successes, total_length in cursor.fetchall()
+        ]
+    
+    async def get_daily_usage(self, since: datetime, user_id: Optional[int] = None) -> List[dict]:
+        """Get per-user, per-day request counts, success rates and average response lengths."""
+        since_day = _to_epoch(since) // SECONDS_PER_DAY * SECONDS_PER_DAY
+        return await self._run(self._get_daily_usage, since_day, user_id)
@@ -0,0 +1,108 @@
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+# A query ending in one of these is treated as finished
+TERMINAL_PUNCTUATION = ('.', '!', '?', '…')
+
+class _TypingState:
+    """Recent inter-keystroke intervals of one user."""
+    
+    def __init__(self, now: float, window: int):
+        self.last_keystroke = now
+        self.intervals: Deque[float] = deque(maxlen=window)
+
+class AdaptiveDebouncer:
+    """Per-user debounce delay predicted from each user's typing rhythm.
+    
+    Keeps each user's last few inter-keystroke intervals and waits
+    safety_factor times the longest of them after a keystroke, clamped to
+    [min_delay, max_delay]. Waiting past the longest recent pause keeps
+    mid-word dispatches (and the Gemini calls they waste) rare, while fast
+    typists no longer pay the full delay. Pauses longer than max_delay are not
+    typing and are ignored. Users with too few samples get max_delay. The
+    per-user table is an LRU bounded to max_users entries.
+    """
+    
+    def __init__(self, max_delay: float = 2.0, min_delay: float = 0.3, adaptive: bool = True,
+                 max_users: int = 10000, window: int = 32, min_samples: int = 5,
+                 safety_factor: float = 2.0):
+        self.max_delay = max_delay
+        self.min_delay = min(min_delay, max_delay)
+        self.adaptive = adaptive
+        self.max_users = max_users
+        self.window = window
+        self.min_samples = min_samples
+        self.safety_factor = safety_factor
+        
+        self._users: "OrderedDict[int, _TypingState]" = OrderedDict()
+        
+        # Statistics
+        self.completed = 0
+        self.skipped = 0
+        self.cancelled_waiting = 0
+        self.cancelled_dispatched = 0
+    
+    def observe(self, user_id: int, now: Optional[float] = None):
+        """Record a keystroke (inline query update) from a user."""
+        now = time.monotonic() if now is None else now
+        state = self._users.get(user_id)
+        if state is None:
+            self._users[user_id] = _TypingState(now, self.window)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return
+        
+        self._users.move_to_end(user_id)
+        interval = now - state.last_keystroke
+        state.last_keystroke = now
+        if interval <= self.max_delay:
+            state.intervals.append(interval)
+    
+    def delay_for(self, user_id: int, query: str) -> float:
+        """Get how long to wait for further keystrokes before answering."""
+        if query.rstrip().endswith(TERMINAL_PUNCTUATION):
+            return 0.0
+        if not self.adaptive:
+            return self.max_delay
+        
+        state = self._users.get(user_id)
+        if state is None or len(state.intervals) < self.min_samples:
+            return self.max_delay
+        predicted = self.safety_factor * max(state.intervals)
+        return max(self.min_delay, min(self.max_delay, predicted))
+    
+    def record_skipped(self):
+        """Count a query answered without waiting."""
+        self.skipped += 1
+    
+    def record_completed(self):
+        """Count a query that was answered."""
+        self.completed += 1
+    
+    def record_cancelled(self, dispatched: bool):
+        """Count a query superseded by a later keystroke.
+        
+        dispatched means the debounce had already elapsed, i.e. work was
+        started that the user no longer needed.
+        """
+        if dispatched:
+            self.cancelled_dispatched += 1
+        else:
+            self.cancelled_waiting += 1
+    
+    def stats(self) -> dict:
+        """Get cancelled-vs-completed counters."""
+        cancelled = self.cancelled_waiting + self.cancelled_dispatched
+        total = cancelled + self.completed
+        return {
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "cancelled_waiting": self.cancelled_waiting,
+            "cancelled_dispatched": self.cancelled_dispatched,
+            "cancelled_ratio": cancelled / total if total else 0.0,
+            "tracked_users": len(self._users),
+        }
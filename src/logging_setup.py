@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed in extra={...}
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, including their extra fields.
+    
+    Events logged with extra={'user_id': ..., 'query_id': ..., 'stage': ...,
+    'duration_ms': ...} become queryable fields instead of text to parse.
+    """
+    
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'sampled':
+                event[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event['exception'] = record.exc_text
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of high-volume events.
+    
+    Applies to records logged with extra={'sampled': True} (e.g. one line
+    per keystroke) below WARNING; everything else always passes.
+    """
+    
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves message formatting to the listener thread.
+    
+    The stock handler formats every record in the logging thread (the event
+    loop, here) before queueing it. Log arguments are plain values, so the
+    record can be queued as is.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            # Render while the traceback's frames are still current
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+def _file_handler(log_file: str, max_bytes: int, backup_count: int, rotate_when: str) -> logging.Handler:
+    """Create the log file handler, rotating by time if rotate_when is set, else by size."""
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if rotate_when:
+        return TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    return RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+def setup_logging(level: str = 'INFO', log_file: str = './logs/bot.log', log_format: str = 'json',
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, rotate_when: str = '',
+                  sample_rate: float = 1.0) -> QueueListener:
+    """Route all logging through a queue to a background thread.
+    
+    Logging calls only put the record on a queue; formatting and the file
+    and console writes happen on the listener thread, so a slow disk never
+    stalls the event loop. The file gets JSON lines (or text) and rotates;
+    the console keeps the text format. Stopped (flushed) at exit.
+    """
+    file_handler = _file_handler(log_file, max_bytes, backup_count, rotate_when)
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+    
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
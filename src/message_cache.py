@@ -0,0 +1,303 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from coordination import Coordinator
+from database import DatabaseManager
+from similarity import TopicIndex
+
+logger = logging.getLogger(__name__)
+
+# How old an expired entry may be and still be served while the API is down
+STALE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# Near-duplicate matches this far below the similarity threshold are counted
+# as near misses, i.e. hits a lower threshold would have gained
+NEAR_MISS_MARGIN = 0.1
+
+class Variant(NamedTuple):
+    """A generated message and the tone it was written in, if known."""
+    text: str
+    tone: Optional[str] = None
+
+def decode_variants(stored: Optional[list]) -> Optional[List[Variant]]:
+    """Turn cached messages as stored in JSON back into variants.
+
+    Entries are [text, tone] pairs; entries written before tones were kept
+    are plain strings.
+    """
+    if not stored:
+        return None
+    return [Variant(item) if isinstance(item, str) else Variant(*item) for item in stored]
+
+def normalize_topic(topic: str) -> str:
+    """Normalize a topic so trivially different queries share a cache entry."""
+    return ' '.join(topic.lower().split()).strip(' .,!?;:')
+
+class MessageCache:
+    """Two-tier cache of generated messages: an in-memory LRU over SQLite.
+
+    With a similarity threshold, a lookup that misses its exact key falls back
+    to the most similar cached topic (see TopicIndex), so "benefits of IPv6"
+    can reuse the messages generated for "ipv6 benefits".
+
+    With a coordinator, new entries are also shared with other bot processes
+    and refresh() reads them back from there, so an instance on another host
+    can use a topic generated elsewhere.
+    """
+
+    def __init__(self, db: DatabaseManager, model_name: str, variants: int = 1, enabled: bool = True,
+                 ttl_seconds: float = 86400, max_memory_entries: int = 1000,
+                 max_db_entries: int = 10000, similarity_threshold: Optional[float] = None,
+                 coordinator: Optional[Coordinator] = None):
+        self.db = db
+        self.coordinator = coordinator
+        self.model_name = model_name
+        self.variants = variants
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self.similarity_threshold = similarity_threshold
+        self.index = TopicIndex() if similarity_threshold is not None else None
+
+        # cache_key -> (stored_at, messages), oldest first
+        self._memory: "OrderedDict[str, Tuple[float, List[Variant]]]" = OrderedDict()
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.similar_hits = 0
+        self.near_misses = 0
+        self.misses = 0
+
+    def make_key(self, topic: str, min_length: int, max_length: int) -> str:
+        """Build the cache key for a topic and generation settings."""
+        return f"{self.model_name}|{min_length}|{max_length}|{self.variants}|{normalize_topic(topic)}"
+
+    def _remember(self, cache_key: str, messages: List[Variant], stored_at: float):
+        """Insert into the memory tier, evicting the least recently used entry."""
+        self._memory[cache_key] = (stored_at, messages)
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def contains(self, topic: str, min_length: int, max_length: int) -> bool:
+        """Check the memory tier for a fresh entry, without counting a lookup."""
+        if not self.enabled:
+            return False
+
+        entry = self._memory.get(self.make_key(topic, min_length, max_length))
+        return entry is not None and time.time() - entry[0] < self.ttl_seconds
+
+    async def get(self, topic: str, min_length: int, max_length: int) -> Optional[List[Variant]]:
+        """Look up cached messages for a topic."""
+        if not self.enabled:
+            return None
+
+        cache_key = self.make_key(topic, min_length, max_length)
+        now = time.time()
+
+        entry = self._memory.get(cache_key)
+        if entry:
+            stored_at, messages = entry
+            if now - stored_at < self.ttl_seconds:
+                self._memory.move_to_end(cache_key)
+                self.memory_hits += 1
+                return messages
+            del self._memory[cache_key]
+
+        try:
+            messages = decode_variants(await self.db.get_cached_messages(cache_key, self.ttl_seconds))
+        except Exception as e:
+            logger.error("Error reading message cache: %s", e)
+            messages = None
+
+        if messages:
+            # Promote to the memory tier
+            self._remember(cache_key, messages, now)
+            self.db_hits += 1
+            return messages
+
+        messages = await self._get_similar(topic, min_length, max_length)
+        if messages:
+            self.similar_hits += 1
+            return messages
+
+        self.misses += 1
+        return None
+
+    async def _get_similar(self, topic: str, min_length: int, max_length: int) -> Optional[List[Variant]]:
+        """Look up the messages of the most similar cached topic, if similar enough.
+
+        The index only returns topics with the same numbers, negations and
+        comparison order, so "python 3.11" never answers "python 3.12".
+        """
+        if self.index is None:
+            return None
+
+        match = self.index.best_match(
+            topic, self.make_key('', min_length, max_length), self.similarity_threshold - NEAR_MISS_MARGIN
+        )
+        if match is None:
+            return None
+
+        cache_key, score = match
+        if score < self.similarity_threshold:
+            if score >= self.similarity_threshold - NEAR_MISS_MARGIN:
+                self.near_misses += 1
+            return None
+
+        entry = self._memory.get(cache_key)
+        if entry and time.time() - entry[0] < self.ttl_seconds:
+            self._memory.move_to_end(cache_key)
+            return entry[1]
+
+        try:
+            messages = decode_variants(await self.db.get_cached_messages(cache_key, self.ttl_seconds))
+        except Exception as e:
+            logger.error("Error reading message cache: %s", e)
+            return None
+
+        if messages:
+            self._remember(cache_key, messages, time.time())
+        else:
+            # Expired or evicted since it was indexed
+            self.index.remove(cache_key)
+        return messages
+
+    async def load_index(self):
+        """Index the topics of all unexpired database entries for similarity lookups."""
+        if not self.enabled or self.index is None:
+            return
+
+        topics = await self.db.get_cached_topics(self.ttl_seconds)
+        self.index.clear()
+        for cache_key, topic in topics:
+            self.index.add(cache_key, topic)
+        logger.info("Indexed %s cached topics for similarity lookups", len(self.index))
+
+    async def refresh(self, topic: str, min_length: int, max_length: int) -> Optional[List[Variant]]:
+        """Re-read the shared tier for messages another bot process may have stored."""
+        if not self.enabled:
+            return None
+
+        cache_key = self.make_key(topic, min_length, max_length)
+        try:
+            if self.coordinator is not None:
+                messages = decode_variants(await self.coordinator.get_messages(cache_key, self.ttl_seconds))
+            else:
+                messages = decode_variants(await self.db.get_cached_messages(cache_key, self.ttl_seconds))
+        except Exception as e:
+            logger.error("Error reading message cache: %s", e)
+            return None
+
+        if messages:
+            self._remember(cache_key, messages, time.time())
+        return messages
+
+    async def peek(self, topic: str, min_length: int, max_length: int) -> Optional[List[Variant]]:
+        """Look up fresh cached messages without counting a lookup (for suggestions)."""
+        if not self.enabled:
+            return None
+
+        entry = self._memory.get(self.make_key(topic, min_length, max_length))
+        if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return await self.refresh(topic, min_length, max_length)
+
+    async def peek_many(self, topics: List[str], min_length: int, max_length: int) -> Dict[str, List[Variant]]:
+        """Look up fresh cached messages for several topics at once (for suggestions).
+
+        Topics missing from the memory tier are read from SQLite in a single
+        query; the coordinator is not asked. Returns messages by topic for
+        the topics that have any.
+        """
+        if not self.enabled:
+            return {}
+
+        found = {}
+        missing = {}
+        now = time.time()
+        for topic in topics:
+            cache_key = self.make_key(topic, min_length, max_length)
+            entry = self._memory.get(cache_key)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                found[topic] = entry[1]
+            else:
+                missing.setdefault(cache_key, []).append(topic)
+
+        try:
+            stored = await self.db.get_cached_messages_many(list(missing), self.ttl_seconds)
+        except Exception as e:
+            logger.error("Error reading message cache: %s", e)
+            stored = {}
+        for cache_key, messages in stored.items():
+            messages = decode_variants(messages)
+            if messages:
+                self._remember(cache_key, messages, now)
+                found.update((topic, messages) for topic in missing[cache_key])
+        return found
+
+    async def get_stale(self, topic: str, min_length: int, max_length: int) -> Optional[List[Variant]]:
+        """Look up cached messages for a topic, even if expired (fallback during outages)."""
+        if not self.enabled:
+            return None
+
+        cache_key = self.make_key(topic, min_length, max_length)
+        entry = self._memory.get(cache_key)
+        if entry:
+            return entry[1]
+
+        try:
+            return decode_variants(await self.db.get_cached_messages(cache_key, STALE_MAX_AGE_SECONDS))
+        except Exception as e:
+            logger.error("Error reading message cache: %s", e)
+            return None
+
+    async def put(self, topic: str, min_length: int, max_length: int, messages: List[Variant]):
+        """Store generated messages for a topic."""
+        if not self.enabled or not messages:
+            return
+
+        cache_key = self.make_key(topic, min_length, max_length)
+        self._remember(cache_key, messages, time.time())
+        if self.index is not None:
+            self.index.add(cache_key, topic)
+
+        try:
+            self.db.store_cached_messages(cache_key, normalize_topic(topic), messages)
+            if self.coordinator is not None:
+                await self.coordinator.put_messages(cache_key, messages, self.ttl_seconds)
+        except Exception as e:
+            logger.error("Error writing message cache: %s", e)
+
+    async def evict(self) -> int:
+        """Evict expired and excess entries from both tiers."""
+        now = time.time()
+        expired = [key for key, (stored_at, _) in self._memory.items() if now - stored_at >= self.ttl_seconds]
+        for key in expired:
+            del self._memory[key]
+
+        evicted = await self.db.evict_cached_messages(self.ttl_seconds, self.max_db_entries)
+        if evicted:
+            # Drop evicted topics from the similarity index
+            await self.load_index()
+        return evicted
+
+    def stats(self) -> dict:
+        """Get hit/miss counters."""
+        hits = self.memory_hits + self.db_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            # Each similar hit is a Gemini call saved over exact matching
+            "similar_hits": self.similar_hits,
+            "near_misses": self.near_misses,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "similar_hit_rate": self.similar_hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "indexed_topics": len(self.index) if self.index is not None else 0,
+        }
@@ -0,0 +1,212 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of latency histogram buckets, from sub-millisecond
+# SQLite reads up to slow Gemini calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 20.0, 30.0
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are interpolated within buckets."""
+    
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0..1)."""
+        if not self.count:
+            return 0.0
+        
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """In-process counters and latency histograms with Prometheus text output.
+    
+    Recording is a dict lookup plus an integer increment or a bisect, cheap
+    enough for the per-keystroke hot path. Values owned by other components
+    (queue depths, cache counters) are read through callbacks at scrape time.
+    """
+    
+    def __init__(self, prefix: str = 'vibebot'):
+        self.prefix = prefix
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._callbacks: Dict[str, Tuple[str, Callable[[], Dict[LabelKey, float]]]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    @staticmethod
+    def _label_key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Increment a counter."""
+        series = self._counters.setdefault(name, {})
+        key = self._label_key(labels)
+        series[key] = series.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels):
+        """Record a value (seconds) in a histogram."""
+        series = self._histograms.setdefault(name, {})
+        key = self._label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+    
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Time the enclosed block into a histogram, including failed attempts."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    def register_callback(self, name: str, callback: Callable[[], Dict[LabelKey, float]],
+                          metric_type: str = 'gauge'):
+        """Register values read at scrape time, as {label_key: value}."""
+        self._callbacks[name] = (metric_type, callback)
+    
+    def register_gauge(self, name: str, callback: Callable[[], float]):
+        """Register a single unlabelled gauge read at scrape time."""
+        self.register_callback(name, lambda: {(): callback()})
+    
+    def get_histogram(self, name: str, **labels) -> Optional[Histogram]:
+        """Get a histogram series, if anything was recorded."""
+        return self._histograms.get(name, {}).get(self._label_key(labels))
+    
+    def get_counter(self, name: str, **labels) -> float:
+        """Get the current value of a counter series."""
+        return self._counters.get(name, {}).get(self._label_key(labels), 0)
+    
+    def counter_series(self, name: str) -> Dict[LabelKey, float]:
+        """Get every labelled series of a counter."""
+        return dict(self._counters.get(name, {}))
+    
+    def histogram_series(self, name: str) -> Dict[LabelKey, Histogram]:
+        """Get every labelled series of a histogram."""
+        return dict(self._histograms.get(name, {}))
+    
+    @staticmethod
+    def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+    
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        
+        for name, series in sorted(self._counters.items()):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full_name} counter")
+            for key, value in series.items():
+                lines.append(f"{full_name}{self._format_labels(key)} {value}")
+        
+        for name, (metric_type, callback) in sorted(self._callbacks.items()):
+            full_name = f"{self.prefix}_{name}"
+            try:
+                values = callback()
+            except Exception as e:
+                logger.error("Error reading metric %s: %s", name, e)
+                continue
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for key, value in values.items():
+                lines.append(f"{full_name}{self._format_labels(key)} {value}")
+        
+        for name, series in sorted(self._histograms.items()):
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full_name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{self._format_labels(key, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{full_name}_bucket{self._format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{full_name}_sum{self._format_labels(key)} {histogram.sum}")
+                lines.append(f"{full_name}_count{self._format_labels(key)} {histogram.count}")
+        
+        return '\n'.join(lines) + '\n'
+    
+    def summary(self) -> str:
+        """Build a compact human-readable summary of latencies and counters."""
+        parts = []
+        for name, series in sorted(self._histograms.items()):
+            for key, histogram in series.items():
+                parts.append(
+                    f"{name}{self._format_labels(key)} n={histogram.count} "
+                    f"p50={histogram.quantile(0.5) * 1000:.1f}ms "
+                    f"p95={histogram.quantile(0.95) * 1000:.1f}ms "
+                    f"p99={histogram.quantile(0.99) * 1000:.1f}ms"
+                )
+        for name, series in sorted(self._counters.items()):
+            for key, value in series.items():
+                parts.append(f"{name}{self._format_labels(key)}={value:g}")
+        return '; '.join(parts) if parts else 'no metrics recorded'
+    
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode(errors='replace')
+            # Drain the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            
+            path = request_line.split(' ')[1] if request_line.count(' ') >= 2 else ''
+            if path.split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render_prometheus().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error("Error serving metrics: %s", e)
+        finally:
+            writer.close()
+    
+    async def start_server(self, host: str, port: int):
+        """Serve /metrics over HTTP on the running event loop."""
+        self._server = await asyncio.start_server(self._handle_request, host, port)
+        logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    
+    async def stop_server(self):
+        """Stop the metrics HTTP server."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+# Process-wide registry
+metrics = MetricsRegistry()
@@ -0,0 +1,82 @@
+import time
+from typing import Optional, Tuple
+
+class SlidingWindowCounter:
+    """Counts events over a trailing time window using a ring of fixed-size buckets.
+
+    Adding and counting are O(1) amortized: buckets are only cleared when
+    time moves past them. The window is tracked at bucket granularity, so the
+    count may include up to one bucket of events that are slightly too old,
+    which errs on the side of rejecting rather than overspending quota.
+    """
+
+    def __init__(self, window_seconds: float, bucket_seconds: float):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, int(window_seconds // bucket_seconds))
+        self._counts = [0] * self.num_buckets
+        self._total = 0
+        self._head: Optional[int] = None  # Absolute index of the newest bucket
+
+    def _advance(self, now: float):
+        """Clear buckets that have fallen out of the window."""
+        bucket = int(now // self.bucket_seconds)
+        if self._head is None:
+            self._head = bucket
+            return
+        if bucket <= self._head:
+            return
+
+        steps = min(bucket - self._head, self.num_buckets)
+        for offset in range(1, steps + 1):
+            slot = (self._head + offset) % self.num_buckets
+            self._total -= self._counts[slot]
+            self._counts[slot] = 0
+        self._head = bucket
+
+    def add(self, now: float, count: int = 1):
+        """Record events at the given time."""
+        self._advance(now)
+        bucket = int(now // self.bucket_seconds)
+        if bucket <= self._head - self.num_buckets:
+            return  # Older than the window
+
+        self._counts[bucket % self.num_buckets] += count
+        self._total += count
+
+    def count(self, now: float) -> int:
+        """Get the number of events in the window ending at now."""
+        self._advance(now)
+        return self._total
+
+class SlidingWindowRateLimiter:
+    """In-memory per-minute and per-day request limiter."""
+
+    def __init__(self):
+        self._minute = SlidingWindowCounter(60, 1)
+        self._day = SlidingWindowCounter(24 * 60 * 60, 60)
+
+    def record(self, timestamp: Optional[float] = None):
+        """Record a request."""
+        now = time.time() if timestamp is None else timestamp
+        self._minute.add(now)
+        self._day.add(now)
+
+    def remaining(self, requests_per_minute: int, requests_per_day: int) -> Tuple[int, int]:
+        """Get the remaining per-minute and per-day headroom."""
+        now = time.time()
+        return (
+            max(0, requests_per_minute - self._minute.count(now)),
+            max(0, requests_per_day - self._day.count(now)),
+        )
+
+    def check(self, requests_per_minute: int, requests_per_day: int) -> Tuple[bool, str]:
+        """Check if the rate limits allow another request."""
+        minute_left, day_left = self.remaining(requests_per_minute, requests_per_day)
+
+        if minute_left <= 0:
+            return False, f"API rate limit exceeded: {requests_per_minute} requests per minute. Please try again later."
+
+        if day_left <= 0:
+            return False, f"Daily API limit exceeded: {requests_per_day} requests per day. Please try again tomorrow."
+
+        return True, ""
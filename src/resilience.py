@@ -0,0 +1,131 @@
+import time
+import logging
+from typing import Optional
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """The backend is failing and calls are being rejected without trying it."""
+
+class CircuitBreaker:
+    """Fails fast while a backend is failing instead of piling up blocked calls.
+    
+    Opens after failure_threshold consecutive failures. After reset_timeout
+    seconds one probe call is let through (half-open); its success closes the
+    breaker, its failure opens it again.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_inflight = False
+        
+        # Statistics
+        self.times_opened = 0
+        self.rejected = 0
+    
+    def available(self) -> bool:
+        """Check if a call would be allowed, without claiming the half-open probe."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probe_inflight
+    
+    def allow(self) -> bool:
+        """Check if a call may go ahead; the caller must then report its outcome."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            logger.info("Circuit half-open, sending a probe request")
+        
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_inflight:
+            self._probe_inflight = True
+            return True
+        
+        self.rejected += 1
+        return False
+    
+    def record_success(self):
+        """Report a call that reached the backend."""
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed, backend recovered")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_inflight = False
+    
+    def record_failure(self):
+        """Report a call that failed because of the backend (timeout, server error)."""
+        self.consecutive_failures += 1
+        self._probe_inflight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning("Circuit opened after %s consecutive failures", self.consecutive_failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+    
+    def record_cancelled(self):
+        """Report a call abandoned by its caller, telling nothing about the backend."""
+        self._probe_inflight = False
+    
+    def stats(self) -> dict:
+        """Get the breaker state and counters."""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+class HedgePolicy:
+    """Decides when to send a second, hedge request for a slow call.
+    
+    A hedge is sent once a call has been running longer than the observed
+    latency quantile (p95 by default), so only the slow tail is duplicated.
+    Hedges are capped at max_hedge_ratio of all requests so an overall
+    slowdown cannot double the load.
+    """
+    
+    def __init__(self, enabled: bool = True, quantile: float = 0.95, min_samples: int = 20,
+                 max_hedge_ratio: float = 0.1, min_delay: float = 0.2):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_delay = min_delay
+        
+        # Statistics
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+    
+    def delay(self, latency: Optional[Histogram]) -> Optional[float]:
+        """Get how long to wait before hedging, or None to not hedge."""
+        if not self.enabled or latency is None or latency.count < self.min_samples:
+            return None
+        return max(self.min_delay, latency.quantile(self.quantile))
+    
+    def may_hedge(self) -> bool:
+        """Check the hedge budget."""
+        return self.hedges < self.max_hedge_ratio * self.requests
+    
+    def stats(self) -> dict:
+        """Get hedge counters."""
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+        }
@@ -0,0 +1,259 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Optional
+
+from coordination import Coordinator, quota_buckets
+from rate_limiter import SlidingWindowRateLimiter
+
+logger = logging.getLogger(__name__)
+
+class RateLimitExceeded(Exception):
+    """The API quota does not allow the request."""
+
+class DeadlineExceeded(Exception):
+    """Queued work was dropped because its deadline passed before admission."""
+
+class _Job:
+    """A request waiting for admission."""
+    
+    def __init__(self, user_id: int, finish_tag: float, deadline: Optional[float]):
+        self.user_id = user_id
+        self.finish_tag = finish_tag
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class GenerationSlots:
+    """Caps the number of generations running at once, like a semaphore.
+    
+    Used as ``async with slots:``. locked() tells load shedding that every
+    slot is taken.
+    """
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self._inflight = 0
+    
+    def locked(self) -> bool:
+        return self._semaphore.locked()
+    
+    def inflight(self) -> int:
+        """Get the number of generations holding a slot."""
+        return self._inflight
+    
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        self._inflight += 1
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self._inflight -= 1
+        self._semaphore.release()
+
+class FairScheduler:
+    """Admits generation requests against the global Gemini quota, fairly across users.
+    
+    Each user has their own queue. Requests are admitted in order of their
+    weighted-fair-queueing finish tag, so one user typing in many chats cannot
+    starve everyone else. Users over their daily soft cap keep being served,
+    but at a reduced weight. Admission needs headroom in this process's
+    sliding-window limiter and a token from the quota buckets shared through
+    the coordinator, so the limits hold across bot processes. Requests whose
+    deadline passes while queued are dropped. record_admission is called with
+    the user of every admitted request, so today's counts survive a restart.
+    """
+    
+    def __init__(self, rate_limiter: SlidingWindowRateLimiter, coordinator: Coordinator,
+                 requests_per_minute: int, requests_per_day: int, user_soft_cap: int = 50,
+                 over_cap_weight: float = 0.25, record_admission: Optional[Callable[[int], None]] = None):
+        self.rate_limiter = rate_limiter
+        self.coordinator = coordinator
+        self.requests_per_minute = requests_per_minute
+        self.requests_per_day = requests_per_day
+        self.user_soft_cap = user_soft_cap
+        self.over_cap_weight = over_cap_weight
+        self.quota = quota_buckets('api', requests_per_minute, requests_per_day)
+        self.record_admission = record_admission
+        
+        self._queues: Dict[int, Deque[_Job]] = {}
+        self._last_finish: Dict[int, float] = {}
+        self._virtual_time = 0.0
+        
+        # Per-user overrides from the user_limits table
+        self._weights: Dict[int, float] = {}
+        self._soft_caps: Dict[int, int] = {}
+        
+        # Admitted requests per user for the current UTC day
+        self._usage_day = datetime.utcnow().date()
+        self._usage_today: Dict[int, int] = {}
+        
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        # A quota token taken for a job that went away before admission; the
+        # next job gets it instead of taking another one
+        self._token_held = False
+        
+        # Statistics
+        self.admitted = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._recent_waits: Deque[float] = deque(maxlen=1000)
+    
+    def load_user_state(self, user_limits: Dict[int, dict], usage_today: Dict[int, int]):
+        """Load per-user weights, soft caps and today's usage counts."""
+        self._weights = {uid: limits["weight"] for uid, limits in user_limits.items() if limits.get("weight")}
+        self._soft_caps = {uid: limits["daily_soft_cap"] for uid, limits in user_limits.items() if limits.get("daily_soft_cap") is not None}
+        self._usage_day = datetime.utcnow().date()
+        self._usage_today = dict(usage_today)
+    
+    def _weight_for(self, user_id: int) -> float:
+        """Get a user's effective weight, reduced once over their soft cap."""
+        today = datetime.utcnow().date()
+        if today != self._usage_day:
+            self._usage_day = today
+            self._usage_today = {}
+        
+        weight = self._weights.get(user_id, 1.0)
+        soft_cap = self._soft_caps.get(user_id, self.user_soft_cap)
+        if soft_cap and self._usage_today.get(user_id, 0) >= soft_cap:
+            weight *= self.over_cap_weight
+        return weight
+    
+    async def start(self):
+        """Start the dispatcher. Must be called from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch_loop())
+    
+    async def stop(self):
+        """Stop the dispatcher and fail any queued requests."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._fail_all(RateLimitExceeded("Bot is shutting down. Please try again later."))
+    
+    async def acquire(self, user_id: int, deadline: Optional[float] = None):
+        """Wait until the request may call the API.
+        
+        deadline is a time.monotonic() value. Raises RateLimitExceeded when the
+        daily quota is used up, DeadlineExceeded when the deadline passes first.
+        """
+        _, day_left = self.rate_limiter.remaining(self.requests_per_minute, self.requests_per_day)
+        if day_left <= 0:
+            self.rejected += 1
+            raise RateLimitExceeded(
+                f"Daily API limit exceeded: {self.requests_per_day} requests per day. Please try again tomorrow."
+            )
+        
+        start_tag = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+        job = _Job(user_id, start_tag + 1.0 / self._weight_for(user_id), deadline)
+        self._last_finish[user_id] = job.finish_tag
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._wakeup.set()
+        
+        await job.future
+    
+    def _fail_all(self, error: Exception):
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(error)
+        self._queues.clear()
+    
+    def _next_job(self) -> Optional[_Job]:
+        """Get the queued job with the smallest finish tag, dropping dead jobs."""
+        now = time.monotonic()
+        best = None
+        for user_id in list(self._queues):
+            queue = self._queues[user_id]
+            while queue:
+                job = queue[0]
+                if job.future.done():  # Caller went away
+                    queue.popleft()
+                elif job.deadline is not None and now >= job.deadline:
+                    queue.popleft()
+                    self.dropped += 1
+                    job.future.set_exception(DeadlineExceeded("Too many requests right now. Please try again in a moment."))
+                else:
+                    break
+            if not queue:
+                del self._queues[user_id]
+                if self._last_finish.get(user_id, 0.0) <= self._virtual_time:
+                    self._last_finish.pop(user_id, None)
+            elif best is None or queue[0].finish_tag < best.finish_tag:
+                best = queue[0]
+        return best
+    
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _dispatch_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                await self._wait(None)
+                continue
+            
+            minute_left, day_left = self.rate_limiter.remaining(self.requests_per_minute, self.requests_per_day)
+            if day_left <= 0:
+                self.rejected += sum(len(queue) for queue in self._queues.values())
+                self._fail_all(RateLimitExceeded(
+                    f"Daily API limit exceeded: {self.requests_per_day} requests per day. Please try again tomorrow."
+                ))
+                continue
+            
+            if not self._token_held:
+                try:
+                    wait = 1.0 if minute_left <= 0 else await self.coordinator.acquire(self.quota)
+                except Exception as e:
+                    logger.error("Error acquiring API quota: %s", e)
+                    wait = 1.0
+                if wait > 0:
+                    # Sleep until a token frees up, waking early to drop expired jobs
+                    delay = max(wait, 0.05)
+                    if job.deadline is not None:
+                        delay = min(delay, max(0.0, job.deadline - time.monotonic()))
+                    await self._wait(delay)
+                    continue
+                self._token_held = True
+            
+            # The job may have gone while the coordinator was asked; then the
+            # next one in line gets the token, or it is kept until one arrives
+            job = self._next_job()
+            if job is None:
+                continue
+            
+            self._token_held = False
+            self._queues[job.user_id].popleft()
+            self._virtual_time = job.finish_tag
+            self._usage_today[job.user_id] = self._usage_today.get(job.user_id, 0) + 1
+            if self.record_admission is not None:
+                self.record_admission(job.user_id)
+            self._recent_waits.append(time.monotonic() - job.enqueued_at)
+            self.admitted += 1
+            job.future.set_result(None)
+    
+    def stats(self) -> dict:
+        """Get queue depth and wait time statistics."""
+        waits = sorted(self._recent_waits)
+        return {
+            "queue_depth": sum(len(queue) for queue in self._queues.values()),
+            "queued_users": len(self._queues),
+            "admitted": self.admitted,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait_seconds": waits[int(len(waits) * 0.95)] if waits else 0.0,
+        }
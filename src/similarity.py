@@ -0,0 +1,157 @@
+import re
+import math
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Words that don't change what a message is about ("benefits of IPv6")
+STOPWORDS = frozenset({
+    'a', 'an', 'the', 'of', 'about', 'on', 'for', 'to', 'in', 'and', 'with', 'my', 'your', 'some',
+})
+
+# Words that flip what a topic says ("why ipv6 is not great")
+NEGATIONS = frozenset({'not', 'no', 'never', 'without'})
+
+# Connectors whose operands may not be swapped ("aws vs gcp" is not "gcp vs aws")
+COMPARISON = re.compile(r'(?<!\w)(?:vs|versus|better than|worse than|over)(?!\w)')
+
+# (numbers, negations, comparison operand terms or None) of a topic
+Markers = Tuple[FrozenSet[str], Tuple[str, ...], Optional[Tuple[FrozenSet[str], FrozenSet[str]]]]
+
+def topic_terms(topic: str) -> List[str]:
+    """Split a topic into sorted, de-pluralized terms without stopwords.
+    
+    Sorting makes word order irrelevant; stripping a plural 's' lets
+    "ipv6 benefit" and "ipv6 benefits" agree.
+    """
+    terms = set()
+    for word in re.findall(r'\w+', topic.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.add(word)
+    return sorted(terms)
+
+def topic_markers(topic: str) -> Markers:
+    """Get the parts of a topic that trigram similarity barely sees.
+    
+    Numbers ("python 3.12") and negations change the meaning of a topic by a
+    few characters, and sorted terms lose which side of a comparison each
+    operand is on.
+    """
+    topic = topic.lower()
+    words = re.findall(r"\w+(?:['.]\w+)*", topic)
+    numbers = frozenset(word for word in words if any(char.isdigit() for char in word))
+    negations = tuple(sorted(
+        'not' if word.endswith("n't") else word
+        for word in words if word in NEGATIONS or word.endswith("n't")
+    ))
+    
+    comparison = None
+    match = COMPARISON.search(topic)
+    if match:
+        comparison = (
+            frozenset(topic_terms(topic[:match.start()])),
+            frozenset(topic_terms(topic[match.end():])),
+        )
+    return numbers, negations, comparison
+
+def same_meaning(markers: Markers, other: Markers) -> bool:
+    """Check that two similar topics agree on numbers, negations and operand order."""
+    numbers, negations, comparison = markers
+    other_numbers, other_negations, other_comparison = other
+    if numbers != other_numbers or negations != other_negations:
+        return False
+    if comparison is None or other_comparison is None:
+        return comparison is other_comparison
+
+    (left, right), (other_left, other_right) = comparison, other_comparison
+    # An operand that moved to the other side means the comparison was reversed
+    return not ((left & other_right) - other_left or (right & other_left) - other_right)
+
+def trigrams(topic: str) -> FrozenSet[str]:
+    """Character trigrams of each term, padded so word boundaries count."""
+    grams = set()
+    for term in topic_terms(topic):
+        padded = f"  {term} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+class TopicIndex:
+    """Inverted index from character trigrams to cached topics.
+    
+    Finds the stored topic most similar to a query (Jaccard similarity of
+    their trigram sets), so reordered, partial or misspelled variants of a
+    topic can reuse its cached messages. Only topics sharing a trigram with
+    the query are scored, which keeps lookups well under a millisecond for
+    tens of thousands of topics. Topics that differ in numbers, negations or
+    comparison order are never matched (see same_meaning).
+    """
+    
+    def __init__(self):
+        # cache_key -> trigrams of its topic
+        self._grams: Dict[str, FrozenSet[str]] = {}
+        # cache_key -> markers of its topic
+        self._markers: Dict[str, Markers] = {}
+        # trigram -> cache keys of topics containing it
+        self._postings: Dict[str, Set[str]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._grams)
+    
+    def add(self, cache_key: str, topic: str):
+        """Index a cached topic under its cache key."""
+        self.remove(cache_key)
+        grams = trigrams(topic)
+        if not grams:
+            return
+        self._grams[cache_key] = grams
+        self._markers[cache_key] = topic_markers(topic)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(cache_key)
+    
+    def remove(self, cache_key: str):
+        """Drop a topic, e.g. once its cache entry has expired."""
+        grams = self._grams.pop(cache_key, None)
+        self._markers.pop(cache_key, None)
+        for gram in grams or ():
+            postings = self._postings[gram]
+            postings.discard(cache_key)
+            if not postings:
+                del self._postings[gram]
+    
+    def clear(self):
+        self._grams.clear()
+        self._markers.clear()
+        self._postings.clear()
+    
+    def best_match(self, topic: str, key_prefix: str = '', min_score: float = 0.0) -> Optional[Tuple[str, float]]:
+        """Get (cache_key, similarity) of the most similar indexed topic.
+        
+        Only keys starting with key_prefix (the generation settings part of
+        a cache key) are considered, and only if same_meaning holds. Returns
+        None if no topic reaches min_score.
+        """
+        grams = trigrams(topic)
+        if not grams:
+            return None
+        
+        # A topic with similarity >= min_score shares at least min_overlap of
+        # the query's trigrams, so it must contain one of the rarest
+        # len(grams) - min_overlap + 1 of them; only their postings are read
+        min_overlap = max(1, math.ceil(min_score * len(grams)))
+        rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+        candidates = set().union(*(self._postings.get(gram, ()) for gram in rarest[:len(grams) - min_overlap + 1]))
+        
+        markers = topic_markers(topic)
+        best = None
+        for cache_key in candidates:
+            if not cache_key.startswith(key_prefix):
+                continue
+            other = self._grams[cache_key]
+            overlap = len(grams & other)
+            score = overlap / (len(grams) + len(other) - overlap)
+            if score < min_score or (best is not None and score <= best[1]):
+                continue
+            if same_meaning(markers, self._markers[cache_key]):
+                best = (cache_key, score)
+        return best
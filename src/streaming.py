@@ -0,0 +1,79 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shown after the text while more is being streamed in
+STREAM_CURSOR = ' ▌'
+
+class StreamingMessageEditor:
+    """Progressively edits one inline message, coalescing edits.
+    
+    Telegram rate-limits edits, so partial text is sent at most once every
+    min_interval seconds; updates in between only replace the pending text.
+    The final text is always sent. Flood-wait errors push the next edit back
+    by the requested time instead of failing the stream. Every edit resends
+    reply_markup, since an edit without one removes the message's keyboard.
+    """
+    
+    def __init__(self, bot, inline_message_id: str, min_interval: float = 1.0,
+                 reply_markup: Optional[InlineKeyboardMarkup] = None):
+        self.bot = bot
+        self.inline_message_id = inline_message_id
+        self.min_interval = min_interval
+        self.reply_markup = reply_markup
+        self._next_edit_at = time.monotonic() + min_interval  # The placeholder was just sent
+        self._sent_text: Optional[str] = None
+        
+        # Statistics
+        self.edits = 0
+        self.skipped = 0
+    
+    async def _edit(self, text: str):
+        if text == self._sent_text:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text=text, inline_message_id=self.inline_message_id, reply_markup=self.reply_markup
+            )
+            self._sent_text = text
+            self.edits += 1
+            metrics.inc('stream_edits_total')
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):  # A timedelta in newer releases
+                retry_after = retry_after.total_seconds()
+            logger.warning("Edit rate limited, next edit in %ss", retry_after)
+            metrics.inc('stream_edits_rate_limited_total')
+            self._next_edit_at = time.monotonic() + retry_after
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+            self._sent_text = text
+        self._next_edit_at = time.monotonic() + self.min_interval
+    
+    async def update(self, text: str):
+        """Show partial text if an edit is due; otherwise a later update or finish carries it."""
+        if time.monotonic() < self._next_edit_at:
+            self.skipped += 1
+            return
+        await self._edit(text + STREAM_CURSOR)
+    
+    async def finish(self, text: str):
+        """Send the final text, waiting out the edit interval if needed."""
+        delay = self._next_edit_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(text)
+        if self._sent_text != text:
+            # Rate limited on the final edit; it must not be lost
+            await asyncio.sleep(max(0.0, self._next_edit_at - time.monotonic()))
+            await self._edit(text)
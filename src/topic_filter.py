@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import logging
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Used when no filter file is configured or it does not exist yet
+DEFAULT_BLOCKED_TERMS = [
+    'hate', 'violence', 'illegal', 'harmful', 'dangerous',
+    'porn*', 'sex', 'drug', 'weapon', 'bomb', 'terror*'
+]
+
+# Innocent phrases containing a default blocked term
+DEFAULT_ALLOWED_TERMS = ['weapon-class']
+
+# "drugstore" does not match "drug", but a hyphen ends a word so that
+# "bomb-making" is still blocked; hyphenated compounds are unblocked
+# through the allowed list instead
+_WORD_BOUNDARY_BEFORE = r'(?<!\w)'
+_WORD_BOUNDARY_AFTER = r'(?!\w)'
+
+def normalize_term(term: str) -> str:
+    """Lowercase and collapse whitespace, as done for topics."""
+    return ' '.join(term.lower().split())
+
+def _build_trie(terms: Iterable[str]) -> dict:
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}  # End of term
+    return trie
+
+def _trie_to_pattern(node: dict) -> str:
+    """Turn a trie into a regex that shares common prefixes between terms."""
+    alternatives = []
+    for char, child in sorted(node.items()):
+        if char == '':
+            continue
+        # A trailing '*' matches the rest of the word
+        head = r'\w*' if char == '*' else re.escape(char)
+        alternatives.append(head + _trie_to_pattern(child))
+    
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+def compile_terms(terms: Iterable[str]) -> Optional[Pattern]:
+    """Compile terms into a single word-boundary-aware regex.
+    
+    Terms may be phrases ("drug discovery"), match plurals (-s/-es), and may
+    end in '*' to match any word starting with them ("terror*").
+    """
+    normalized = {normalize_term(term) for term in terms if isinstance(term, str) and term.strip()}
+    if not normalized:
+        return None
+    return re.compile(
+        _WORD_BOUNDARY_BEFORE + '(?:' + _trie_to_pattern(_build_trie(normalized)) + ')(?:e?s)?' + _WORD_BOUNDARY_AFTER
+    )
+
+class TopicFilter:
+    """Block/allow list filter for topics, compiled once and hot-reloadable.
+    
+    The filter file is JSON: {"blocked": [...], "allowed": [...]}. A topic is
+    rejected if it contains a blocked term that is not part of an allowed
+    phrase, e.g. "drug" is blocked but "drug discovery" can be allowed.
+    Verdicts are cached per normalized topic in an LRU.
+    """
+    
+    def __init__(self, filter_path: Optional[str] = None, cache_size: int = 10000):
+        self.filter_path = filter_path
+        self.cache_size = cache_size
+        self._file_signature: Optional[Tuple[int, int, int]] = None
+        self._blocked: Optional[Pattern] = None
+        self._allowed: Optional[Pattern] = None
+        self._verdicts: "OrderedDict[str, bool]" = OrderedDict()
+        
+        # Statistics
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.blocked_count = 0
+        
+        self._load()
+    
+    def _get_file_signature(self) -> Optional[Tuple[int, int, int]]:
+        """Get (mtime, inode, size) of the filter file, or None if missing."""
+        try:
+            stat = os.stat(self.filter_path)
+            return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        except (FileNotFoundError, TypeError):
+            return None
+    
+    def _read_filter_file(self) -> Tuple[List[str], List[str]]:
+        """Read and validate the filter file. Raises on invalid content."""
+        with open(self.filter_path, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("Topic filter must be a JSON object")
+        blocked, allowed = data.get("blocked", []), data.get("allowed", [])
+        if not isinstance(blocked, list) or not isinstance(allowed, list):
+            raise ValueError("'blocked' and 'allowed' must be lists")
+        return blocked, allowed
+    
+    def _compile(self, blocked: List[str], allowed: List[str]):
+        self._blocked = compile_terms(blocked)
+        self._allowed = compile_terms(allowed)
+        self._verdicts.clear()
+        logger.info("Topic filter loaded: %s blocked, %s allowed terms", len(blocked), len(allowed))
+    
+    def _load(self):
+        """Load the filter file, falling back to the default block list."""
+        self._file_signature = self._get_file_signature()
+        if self._file_signature is None:
+            self._compile(DEFAULT_BLOCKED_TERMS, DEFAULT_ALLOWED_TERMS)
+            return
+        
+        try:
+            self._compile(*self._read_filter_file())
+        except Exception as e:
+            logger.error("Error loading topic filter, using default block list: %s", e)
+            self._compile(DEFAULT_BLOCKED_TERMS, DEFAULT_ALLOWED_TERMS)
+    
+    def check_for_changes(self) -> bool:
+        """Reload the filter if its file changed on disk.
+        
+        Returns True if new lists were loaded. An invalid file is logged and
+        the previous lists stay in use.
+        """
+        signature = self._get_file_signature()
+        if signature == self._file_signature:
+            return False
+        
+        self._file_signature = signature
+        if signature is None:
+            logger.warning("Topic filter file removed, using default block list")
+            self._compile(DEFAULT_BLOCKED_TERMS, DEFAULT_ALLOWED_TERMS)
+            return True
+        
+        try:
+            self._compile(*self._read_filter_file())
+        except Exception as e:
+            logger.error("Ignoring invalid topic filter file: %s", e)
+            return False
+        return True
+    
+    def _evaluate(self, topic: str) -> bool:
+        if self._blocked is None:
+            return True
+        blocked_spans = [match.span() for match in self._blocked.finditer(topic)]
+        if not blocked_spans:
+            return True
+        if self._allowed is None:
+            return False
+        
+        allowed_spans = [match.span() for match in self._allowed.finditer(topic)]
+        return all(
+            any(start >= allowed_start and end <= allowed_end for allowed_start, allowed_end in allowed_spans)
+            for start, end in blocked_spans
+        )
+    
+    def is_allowed(self, topic: str) -> bool:
+        """Check if the topic is appropriate for content generation."""
+        topic = normalize_term(topic)
+        verdict = self._verdicts.get(topic)
+        if verdict is not None:
+            self._verdicts.move_to_end(topic)
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            verdict = self._evaluate(topic)
+            self._verdicts[topic] = verdict
+            if len(self._verdicts) > self.cache_size:
+                self._verdicts.popitem(last=False)
+        
+        if not verdict:
+            self.blocked_count += 1
+        return verdict
+    
+    def stats(self) -> dict:
+        """Get verdict cache counters."""
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_entries": len(self._verdicts),
+            "blocked": self.blocked_count,
+        }
@@ -1,7 +1,8 @@
 import os
 import json
 import logging
-from typing import Set, Optional
+import tempfile
+from typing import FrozenSet, Optional, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -9,22 +10,38 @@ logger = logging.getLogger(__name__)
 class WhitelistManager:
     def __init__(self, whitelist_path: str):
         self.whitelist_path = whitelist_path
+        self._user_index: FrozenSet[int] = frozenset()
+        self._file_signature: Optional[Tuple[int, int, int]] = None
         self.whitelist_data = self._load_whitelist()
+        self._rebuild_index()
+    
+    def _get_file_signature(self) -> Optional[Tuple[int, int, int]]:
+        """Get (mtime, inode, size) of the whitelist file, or None if missing."""
+        try:
+            stat = os.stat(self.whitelist_path)
+            return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            return None
+    
+    def _read_whitelist_file(self) -> dict:
+        """Read and validate the whitelist file. Raises on invalid content."""
+        with open(self.whitelist_path, 'r') as f:
+            data = json.load(f)
+        # Ensure proper structure
+        if not isinstance(data, dict):
+            raise ValueError("Whitelist must be a JSON object")
+        if "users" not in data:
+            data["users"] = []
+        if "last_updated" not in data:
+            data["last_updated"] = datetime.utcnow().isoformat()
+        return data
     
     def _load_whitelist(self) -> dict:
         """Load whitelist from JSON file."""
         try:
             if os.path.exists(self.whitelist_path):
-                with open(self.whitelist_path, 'r') as f:
-                    data = json.load(f)
-                    # Ensure proper structure
-                    if not isinstance(data, dict):
-                        data = {"users": [], "last_updated": datetime.utcnow().isoformat()}
-                    if "users" not in data:
-                        data["users"] = []
-                    if "last_updated" not in data:
-                        data["last_updated"] = datetime.utcnow().isoformat()
-                    return data
+                self._file_signature = self._get_file_signature()
+                return self._read_whitelist_file()
             else:
                 # Create initial whitelist file
                 initial_data = {
@@ -35,29 +52,52 @@ class WhitelistManager:
                 self._save_whitelist(initial_data)
                 return initial_data
         except Exception as e:
-            logger.error(f"Error loading whitelist: {e}")
+            logger.error("Error loading whitelist: %s", e)
             return {"users": [], "last_updated": datetime.utcnow().isoformat()}
     
+    def _rebuild_index(self):
+        """Rebuild the set-backed membership index from whitelist_data."""
+        index = set()
+        for user_id in self.whitelist_data.get("users", []):
+            try:
+                index.add(int(user_id))
+            except (TypeError, ValueError):
+                logger.warning("Ignoring invalid user ID in whitelist: %r", user_id)
+        self._user_index = frozenset(index)
+    
     def _save_whitelist(self, data: dict) -> bool:
-        """Save whitelist to JSON file."""
+        """Save whitelist to JSON file atomically (temp file plus rename)."""
         try:
-            os.makedirs(os.path.dirname(self.whitelist_path), exist_ok=True)
+            directory = os.path.dirname(self.whitelist_path) or '.'
+            os.makedirs(directory, exist_ok=True)
             data["last_updated"] = datetime.utcnow().isoformat()
-            with open(self.whitelist_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.whitelist-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.whitelist_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            
             self.whitelist_data = data
+            self._rebuild_index()
+            self._file_signature = self._get_file_signature()
             return True
         except Exception as e:
-            logger.error(f"Error saving whitelist: {e}")
+            logger.error("Error saving whitelist: %s", e)
             return False
     
     def is_user_whitelisted(self, user_id: int) -> bool:
         """Check if user is in whitelist."""
-        return user_id in self.whitelist_data.get("users", [])
+        return user_id in self._user_index
     
     def add_user(self, user_id: int, username: Optional[str] = None) -> bool:
         """Add user to whitelist."""
-        if user_id not in self.whitelist_data["users"]:
+        if user_id not in self._user_index:
             self.whitelist_data["users"].append(user_id)
             # Store user info for reference (optional)
             if "user_info" not in self.whitelist_data:
@@ -72,8 +112,10 @@ class WhitelistManager:
     
     def remove_user(self, user_id: int) -> bool:
         """Remove user from whitelist."""
-        if user_id in self.whitelist_data["users"]:
-            self.whitelist_data["users"].remove(user_id)
+        if user_id in self._user_index:
+            self.whitelist_data["users"] = [
+                uid for uid in self.whitelist_data["users"] if str(uid) != str(user_id)
+            ]
             # Remove user info if exists
             if "user_info" in self.whitelist_data and str(user_id) in self.whitelist_data["user_info"]:
                 del self.whitelist_data["user_info"][str(user_id)]
@@ -86,9 +128,32 @@ class WhitelistManager:
     
     def get_user_count(self) -> int:
         """Get number of whitelisted users."""
-        return len(self.whitelist_data.get("users", []))
+        return len(self._user_index)
     
     def reload_whitelist(self):
         """Reload whitelist from file."""
         self.whitelist_data = self._load_whitelist()
+        self._rebuild_index()
         logger.info("Whitelist reloaded from file")
+    
+    def check_for_changes(self) -> bool:
+        """Reload the whitelist if the file changed on disk. Returns True if reloaded.
+        
+        Only a stat() call when nothing changed. An unreadable or half-written
+        file keeps the current index in place until the next check.
+        """
+        signature = self._get_file_signature()
+        if signature is None or signature == self._file_signature:
+            return False
+        
+        self._file_signature = signature
+        try:
+            data = self._read_whitelist_file()
+        except Exception as e:
+            logger.warning("Ignoring unreadable whitelist update: %s", e)
+            return False
+        
+        self.whitelist_data = data
+        self._rebuild_index()
+        logger.info("Whitelist reloaded from file (%s users)", len(self._user_index))
+        return True
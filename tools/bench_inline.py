@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the inline query pipeline.
+
+Drives VibeMessageBot.handle_inline_query with synthetic updates: many users
+typing topics one keystroke at a time (exercising debounce and cancellation),
+with topics repeated across users following a Zipf-like distribution. Gemini
+is replaced by a stub model with configurable latency and error rates, and
+query.answer by a recorder, so no network access is needed. SQLite is real
+(a temporary database unless --db is given).
+
+Reports answered queries per second, answer latency percentiles, Gemini calls
+per answered query and time spent in SQLite.
+
+Usage:
+    python3 tools/bench_inline.py --users 50 --sessions 5 --topics 30
+    python3 tools/bench_inline.py --latency-ms 800 --error-rate 0.05 --json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = [
+    "IPv6", "Rust ownership", "Kubernetes operators", "Python asyncio", "WebAssembly",
+    "Postgres vacuum", "GraphQL federation", "TypeScript generics", "eBPF", "HTTP/3",
+    "SQLite WAL mode", "Terraform state", "gRPC streaming", "Zero trust networking",
+    "Feature flags", "Event sourcing", "Vector databases", "CRDTs", "Monorepos",
+    "Observability", "Chaos engineering", "Edge computing", "Service meshes",
+    "Code review culture", "Technical debt", "LLM agents", "Kafka", "Redis streams",
+    "Nix", "Bazel",
+]
+
+class StubGeminiModel:
+    """Stands in for genai.GenerativeModel with synthetic latency and errors."""
+    
+    def __init__(self, rng: random.Random, latency_ms: float, latency_sigma: float,
+                 error_rate: float, quota_error_rate: float, variants: int):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.variants = variants
+        self.calls = 0
+        self._async_client = object()  # Keeps AIService from creating a real client
+    
+    async def generate_content_async(self, prompt: str, generation_config=None):
+        from google.api_core import exceptions as google_exceptions
+        
+        self.calls += 1
+        # Log-normal latency around the configured median
+        await asyncio.sleep(self.latency_ms / 1000.0 * self.rng.lognormvariate(0, self.latency_sigma))
+        
+        roll = self.rng.random()
+        if roll < self.quota_error_rate:
+            raise google_exceptions.ResourceExhausted("stub quota exhausted")
+        if roll < self.quota_error_rate + self.error_rate:
+            raise google_exceptions.ServiceUnavailable("stub server error")
+        
+        message = ("Synthetic benchmark message. " * 14)[:350]
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            return SimpleNamespace(text=json.dumps([
+                {"tone": f"tone{i}", "message": message} for i in range(self.variants)
+            ]))
+        return SimpleNamespace(text=message)
+
+class AnswerRecorder:
+    """Records when each inline query was sent and answered."""
+    
+    def __init__(self):
+        self.sent: Dict[str, float] = {}
+        self.answered: Dict[str, float] = {}
+        self.final: List[str] = []  # Last keystroke of each typed topic
+    
+    def make_query_class(self):
+        from telegram import InlineQuery
+        
+        recorder = self
+        
+        class FakeInlineQuery(InlineQuery):
+            async def answer(self, results, *args, **kwargs):
+                recorder.answered[self.id] = time.monotonic()
+                return True
+        
+        return FakeInlineQuery
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def simulate_user(bot, query_class, recorder: AnswerRecorder, rng: random.Random,
+                        user_id: int, topics: List[str], weights: List[float], args, tasks: list):
+    """Type several topics, one inline query per keystroke, as Telegram would send them."""
+    from telegram import Update, User
+    
+    user = User(user_id, f"User{user_id}", False)
+    # Users type at different speeds; each one's rhythm varies log-normally around it
+    typing_ms = args.keystroke_ms * rng.uniform(0.5, 2.0)
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    
+    for session in range(args.sessions):
+        topic = rng.choices(topics, weights)[0]
+        for length in range(1, len(topic) + 1):
+            query_id = f"{user_id}-{session}-{length}"
+            query = query_class(id=query_id, from_user=user, query=topic[:length], offset="")
+            recorder.sent[query_id] = time.monotonic()
+            task = asyncio.create_task(
+                bot.handle_inline_query(Update(user_id * 100000 + session * 1000 + length, inline_query=query), None)
+            )
+            tasks.append(task)
+            await asyncio.sleep(typing_ms / 1000.0 * rng.lognormvariate(0, args.keystroke_sigma))
+        
+        recorder.final.append(query_id)
+        
+        # Wait for the results, then read and pick one before typing the next topic
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(rng.expovariate(1.0 / args.think_time))
+
+async def run_benchmark(args) -> dict:
+    import logging
+    import bot as bot_module
+    from metrics import metrics
+    
+    # Keep stdout for the report
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+            handler.setStream(sys.stderr)
+    
+    rng = random.Random(args.seed)
+    recorder = AnswerRecorder()
+    query_class = recorder.make_query_class()
+    
+    bot = bot_module.VibeMessageBot()
+    stubs = []
+    for backend in bot.backend_pool.backends:
+        stub = StubGeminiModel(rng, args.latency_ms, args.latency_sigma, args.error_rate,
+                               args.quota_error_rate, bot.message_variants)
+        backend.service.model = stub
+        stubs.append(stub)
+    
+    await bot._post_init(bot.application)
+    
+    topics = TOPICS[:args.topics] + [f"{TOPICS[i % len(TOPICS)]} {i}" for i in range(len(TOPICS), args.topics)]
+    weights = [1.0 / (rank + 1) ** args.zipf for rank in range(len(topics))]
+    
+    tasks: list = []
+    start = time.monotonic()
+    await asyncio.gather(*(
+        simulate_user(bot, query_class, recorder, rng, 1000 + i, topics, weights, args, tasks)
+        for i in range(args.users)
+    ))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - start
+    
+    await bot._post_shutdown(bot.application)
+    
+    latencies = [recorder.answered[qid] - recorder.sent[qid] for qid in recorder.answered]
+    # What the user waits for: from their last keystroke to the answer
+    perceived = [recorder.answered[qid] - recorder.sent[qid] for qid in recorder.final if qid in recorder.answered]
+    gemini_calls = sum(stub.calls for stub in stubs)
+    
+    db_seconds = {}
+    for key, histogram in metrics.histogram_series('db_operation_seconds').items():
+        db_seconds[dict(key)['op']] = {"count": histogram.count, "seconds": round(histogram.sum, 4)}
+    # Quota buckets and generation leases use their own connection
+    for key, histogram in metrics.histogram_series('coordination_seconds').items():
+        db_seconds[f"coordination.{dict(key)['op']}"] = {"count": histogram.count, "seconds": round(histogram.sum, 4)}
+    
+    return {
+        "keystrokes": len(recorder.sent),
+        "answered": len(latencies),
+        "cancelled": int(metrics.get_counter('inline_queries_cancelled_total')),
+        "elapsed_seconds": round(elapsed, 2),
+        "answered_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "perceived_p50_ms": round(percentile(perceived, 0.50) * 1000, 1),
+        "perceived_p95_ms": round(percentile(perceived, 0.95) * 1000, 1),
+        "gemini_calls": gemini_calls,
+        "gemini_calls_per_answer": round(gemini_calls / len(latencies), 3) if latencies else 0.0,
+        "outcomes": {
+            dict(key)['outcome']: int(value)
+            for key, value in metrics.counter_series('inline_queries_total').items()
+        },
+        "sqlite_seconds": round(sum(op["seconds"] for op in db_seconds.values()), 4),
+        "sqlite_operations": db_seconds,
+        "cache": bot.message_cache.stats(),
+        "coalescer": bot.coalescer.stats(),
+        "debounce": bot.debouncer.stats(),
+        "scheduler": bot.scheduler.stats(),
+    }
+
+def print_report(report: dict):
+    print(f"Keystrokes sent:          {report['keystrokes']}")
+    print(f"Queries answered:         {report['answered']} ({report['cancelled']} cancelled by debounce)")
+    print(f"Elapsed:                  {report['elapsed_seconds']}s")
+    print(f"Answered queries/s:       {report['answered_per_second']}")
+    print(f"Answer latency p50/p95/p99: {report['latency_p50_ms']} / {report['latency_p95_ms']} / {report['latency_p99_ms']} ms")
+    print(f"Perceived p50/p95:        {report['perceived_p50_ms']} / {report['perceived_p95_ms']} ms (last keystroke to answer)")
+    print(f"Gemini calls:             {report['gemini_calls']} ({report['gemini_calls_per_answer']} per answered query)")
+    print(f"Outcomes:                 {', '.join(f'{k}={v}' for k, v in sorted(report['outcomes'].items()))}")
+    print(f"SQLite time:              {report['sqlite_seconds']}s")
+    for op, stat in sorted(report['sqlite_operations'].items()):
+        print(f"  {op:<24}  {stat['count']:>6} calls  {stat['seconds']:.4f}s")
+    print(f"Cache:                    hit rate {report['cache']['hit_rate']:.1%} "
+          f"({report['cache']['similar_hits']} near-duplicate hits)")
+    print(f"Debounce:                 {report['debounce']['completed']} completed, "
+          f"{report['debounce']['cancelled_waiting']} cancelled while waiting, "
+          f"{report['debounce']['cancelled_dispatched']} cancelled after dispatch, "
+          f"{report['debounce']['skipped']} answered without waiting")
+    print(f"Coalescer:                {report['coalescer']['calls']} calls, {report['coalescer']['coalesced']} coalesced")
+    print(f"Scheduler:                p95 admission wait {report['scheduler']['p95_wait_seconds'] * 1000:.1f} ms, "
+          f"{report['scheduler']['dropped']} dropped")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=5, help='topics typed per user')
+    parser.add_argument('--topics', type=int, default=30, help='number of distinct topics')
+    parser.add_argument('--zipf', type=float, default=1.0, help='topic popularity skew (0 = uniform)')
+    parser.add_argument('--keystroke-ms', type=float, default=150.0, help='median delay between keystrokes')
+    parser.add_argument('--keystroke-sigma', type=float, default=0.5, help='log-normal keystroke delay spread')
+    parser.add_argument('--think-time', type=float, default=3.0, help='mean seconds between topics')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='seconds over which users start')
+    parser.add_argument('--latency-ms', type=float, default=1200.0, help='median stub Gemini latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.4, help='log-normal latency spread')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls failing with a server error')
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help='fraction of calls failing with a quota error')
+    parser.add_argument('--debounce', type=float, default=None, help='override DEBOUNCE_DELAY_SECONDS')
+    parser.add_argument('--fixed-debounce', action='store_true', help='disable adaptive debouncing')
+    parser.add_argument('--rpm', type=int, default=600, help='API requests per minute')
+    parser.add_argument('--rpd', type=int, default=100000, help='API requests per day')
+    parser.add_argument('--db', default=None, help='database path (default: a temporary file)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='vibebench-')
+    # Must be set before importing bot, which configures logging and reads .env
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': os.environ.get('TELEGRAM_BOT_TOKEN', '0:bench'),
+        'GOOGLE_AI_API_KEY': os.environ.get('GOOGLE_AI_API_KEY', 'bench'),
+        'DATABASE_PATH': args.db or os.path.join(workdir, 'bench.db'),
+        'LOG_FILE': os.path.join(workdir, 'bench.log'),
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+        'WHITELIST_ENABLED': 'false',
+        'METRICS_PORT': '0',
+        'METRICS_SUMMARY_INTERVAL_SECONDS': '0',
+        'API_REQUESTS_PER_MINUTE': str(args.rpm),
+        'API_REQUESTS_PER_DAY': str(args.rpd),
+    })
+    if args.debounce is not None:
+        os.environ['DEBOUNCE_DELAY_SECONDS'] = str(args.debounce)
+    if args.fixed_debounce:
+        os.environ['DEBOUNCE_ADAPTIVE'] = 'false'
+    sys.path.insert(0, ROOT)
+    
+    report = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    main()
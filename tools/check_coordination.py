@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Multi-process check that coordinated limits hold under concurrency.
+
+Starts several worker processes that each hammer the same coordinator, the
+way several bot instances would:
+
+- quota: every worker takes tokens from one shared per-minute/per-day quota
+  as fast as it can. At no point may the tokens granted across all workers
+  exceed the bucket capacity plus what refilled since the start.
+- leases: every worker repeatedly tries to take the same few generation
+  leases and holds them briefly. No two workers may hold a key at once.
+
+Exits with status 1 if either invariant is violated.
+
+Usage:
+    python3 tools/check_coordination.py --processes 8 --duration 5
+    python3 tools/check_coordination.py --backend redis --redis-url redis://localhost:6379/0
+"""
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from coordination import create_coordinator, quota_buckets
+from database import DatabaseManager
+
+LEASE_HOLD_SECONDS = 0.01
+
+async def run_worker(args, run_id: str, start_at: float) -> Tuple[List[float], List[Tuple[str, float, float]]]:
+    coordinator = create_coordinator(args.backend, args.db, args.redis_url)
+    await coordinator.start()
+    quota = quota_buckets(f"check-{run_id}", args.per_minute, args.per_day)
+    keys = [f"check-{run_id}:topic-{index}" for index in range(args.keys)]
+    
+    # Start together so the workers really contend
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    end_at = start_at + args.duration
+    
+    grants = []
+    holds = []
+    index = 0
+    while time.time() < end_at:
+        wait = await coordinator.acquire(quota)
+        if wait == 0:
+            grants.append(time.time())  # Never earlier than the actual take
+        
+        key = keys[index % len(keys)]
+        index += 1
+        if await coordinator.try_lock(key, ttl=5.0):
+            # Recorded inside the lease, so overlapping intervals mean a violation
+            taken = time.time()
+            await asyncio.sleep(LEASE_HOLD_SECONDS)
+            released = time.time()
+            await coordinator.unlock(key)
+            holds.append((key, taken, released))
+        elif wait > 0:
+            await asyncio.sleep(min(wait, 0.01))
+    
+    await coordinator.close()
+    return grants, holds
+
+def worker(args, run_id: str, start_at: float, results):
+    results.put(asyncio.run(run_worker(args, run_id, start_at)))
+
+def check_quota(grants: List[float], start_at: float, per_minute: int) -> int:
+    """Count moments where more tokens were granted than the bucket allows."""
+    capacity, rate = max(1, per_minute), max(1, per_minute) / 60.0
+    violations = 0
+    for count, granted_at in enumerate(sorted(grants), start=1):
+        if count > capacity + rate * (granted_at - start_at) + 1e-6:
+            violations += 1
+    return violations
+
+def check_leases(holds: List[Tuple[str, float, float]]) -> int:
+    """Count lease intervals that overlap another owner's interval on the same key."""
+    by_key: Dict[str, List[Tuple[float, float]]] = {}
+    for key, taken, released in holds:
+        by_key.setdefault(key, []).append((taken, released))
+    
+    violations = 0
+    for intervals in by_key.values():
+        intervals.sort()
+        for (_, previous_end), (start, _) in zip(intervals, intervals[1:]):
+            if start < previous_end:
+                violations += 1
+    return violations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to run')
+    parser.add_argument('--per-minute', type=int, default=120, help='shared requests per minute')
+    parser.add_argument('--per-day', type=int, default=100000, help='shared requests per day')
+    parser.add_argument('--keys', type=int, default=3, help='number of contended leases')
+    parser.add_argument('--backend', choices=['sqlite', 'redis'], default='sqlite')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--db', default=None, help='database path (default: a temporary file)')
+    args = parser.parse_args()
+    
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix='vibecoord-'), 'coordination.db')
+    if args.backend == 'sqlite':
+        # Creates the coordination tables
+        asyncio.run(DatabaseManager(args.db).close())
+    
+    run_id = uuid.uuid4().hex[:8]
+    start_at = time.time() + 1.0
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(args, run_id, start_at, results))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    
+    grants = [granted_at for worker_grants, _ in outcomes for granted_at in worker_grants]
+    holds = [hold for _, worker_holds in outcomes for hold in worker_holds]
+    allowed = min(args.per_minute + args.per_minute / 60.0 * args.duration, args.per_day)
+    quota_violations = check_quota(grants, start_at, args.per_minute)
+    lease_violations = check_leases(holds)
+    
+    print(f"Processes:                {args.processes} ({args.backend})")
+    print(f"Tokens granted:           {len(grants)} (at most {allowed:.0f} allowed)")
+    print(f"Per process:              {', '.join(str(len(worker_grants)) for worker_grants, _ in outcomes)}")
+    print(f"Quota violations:         {quota_violations}")
+    print(f"Leases held:              {len(holds)} on {args.keys} keys")
+    print(f"Lease overlaps:           {lease_violations}")
+    
+    if quota_violations or lease_violations:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
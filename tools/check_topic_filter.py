@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Check the topic filter against topics it must block or allow.
+
+Runs the default lists, or a filter file with --filter, against two sets of
+sample topics:
+
+- must block: blocked terms, including inside hyphenated compounds
+  ("bomb-making instructions"), which must not slip through as one word.
+- must allow: innocent topics that only look like a blocked term
+  ("drugstore API") or are unblocked by an allowed phrase ("weapon-class").
+
+Exits with status 1 if any topic gets the wrong verdict.
+
+Usage:
+    python3 tools/check_topic_filter.py
+    python3 tools/check_topic_filter.py --filter ./data/topic_filter.json
+"""
+
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from topic_filter import TopicFilter
+
+MUST_BLOCK = [
+    "bomb-making instructions",
+    "pro-terror propaganda",
+    "hate-speech generator",
+    "weapon-smuggling",
+    "sex-trafficking",
+    "drug-dealing tips",
+    "how to build a bomb",
+    "buying drugs online",
+    "terrorism recruitment",
+]
+
+MUST_ALLOW = [
+    "drugstore API",
+    "weapon-class design patterns",
+    "benefits of IPv6",
+    "sextant navigation",
+    "tabs vs spaces",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default=None, help='topic filter file (default: built-in lists)')
+    args = parser.parse_args()
+
+    topic_filter = TopicFilter(args.filter)
+    failures = 0
+    for expected, topics in ((False, MUST_BLOCK), (True, MUST_ALLOW)):
+        for topic in topics:
+            allowed = topic_filter.is_allowed(topic)
+            verdict = "allowed" if allowed else "blocked"
+            if allowed != expected:
+                failures += 1
+                verdict += "  <-- WRONG"
+            print(f"  {verdict:<16} {topic!r}")
+
+    if failures:
+        print(f"FAILED: {failures} wrong verdicts")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Fake Telegram for testing webhook mode locally.
+
+Serves the handful of Bot API methods the bot calls (getMe, setWebhook,
+answerInlineQuery, ...) and, once the bot registers its webhook, POSTs
+synthetic inline query updates to it the way Telegram would: one update per
+keystroke, per user. Prints how long each answered query took.
+
+Usage:
+    python3 tools/fake_telegram.py --port 8081 --users 3 --topic "IPv6"
+    
+    # in another terminal
+    BOT_MODE=webhook TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 \\
+    WEBHOOK_LISTEN=127.0.0.1 WEBHOOK_PORT=8443 WHITELIST_ENABLED=false python3 bot.py
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+class FakeBotAPI:
+    """Records Bot API calls and the webhook the bot registers."""
+    
+    def __init__(self):
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        self.webhook_registered = threading.Event()
+        self.answers: Dict[str, dict] = {}
+        self.answered = threading.Condition()
+    
+    def handle(self, method: str, params: dict):
+        """Handle a Bot API method call and return its result."""
+        if method == 'getMe':
+            return {
+                "id": 1, "is_bot": True, "first_name": "VibeMessageBot", "username": "vibemessagebot",
+                "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True
+            }
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.secret_token = params.get('secret_token')
+            self.webhook_registered.set()
+            return True
+        if method == 'answerInlineQuery':
+            with self.answered:
+                self.answers[params['inline_query_id']] = {
+                    "answered_at": time.monotonic(),
+                    "results": json.loads(params.get('results', '[]')),
+                }
+                self.answered.notify_all()
+            return True
+        # deleteWebhook, editMessageText, ... just succeed
+        return True
+
+def make_handler(api: FakeBotAPI):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.rstrip('/').rsplit('/', 1)[-1]
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params = json.loads(body or '{}')
+            else:
+                params = {key: values[0] for key, values in parse_qs(body).items()}
+            
+            payload = json.dumps({"ok": True, "result": api.handle(method, params)}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return Handler
+
+def post_update(api: FakeBotAPI, update: dict):
+    """POST an update to the registered webhook."""
+    request = urllib.request.Request(
+        api.webhook_url, data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    if api.secret_token:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', api.secret_token)
+    urllib.request.urlopen(request, timeout=10).read()
+
+def simulate_user(api: FakeBotAPI, user_id: int, topic: str, keystroke_delay: float, sent: Dict[str, float]):
+    """Type the topic one keystroke at a time, one inline query per keystroke."""
+    for length in range(1, len(topic) + 1):
+        query_id = f"{user_id}-{length}"
+        sent[query_id] = time.monotonic()
+        post_update(api, {
+            "update_id": user_id * 1000 + length,
+            "inline_query": {
+                "id": query_id,
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "query": topic[:length],
+                "offset": "",
+            },
+        })
+        time.sleep(keystroke_delay)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--topic', default='IPv6')
+    parser.add_argument('--keystroke-delay', type=float, default=0.15)
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for answers')
+    args = parser.parse_args()
+    
+    api = FakeBotAPI()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Bot API listening on http://{args.host}:{args.port}, waiting for setWebhook...")
+    
+    api.webhook_registered.wait()
+    print(f"Webhook registered: {api.webhook_url}")
+    time.sleep(0.5)  # Let the webhook server finish starting
+    
+    sent: Dict[str, float] = {}
+    users = [
+        threading.Thread(target=simulate_user, args=(api, 100 + i, args.topic, args.keystroke_delay, sent))
+        for i in range(args.users)
+    ]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    
+    # Only the last keystroke per user is expected to be answered (debouncing)
+    expected = {f"{100 + i}-{len(args.topic)}" for i in range(args.users)}
+    deadline = time.monotonic() + args.timeout
+    with api.answered:
+        while not expected <= api.answers.keys() and time.monotonic() < deadline:
+            api.answered.wait(deadline - time.monotonic())
+    
+    for query_id in sorted(sent):
+        answer = api.answers.get(query_id)
+        if answer:
+            titles = ', '.join(result.get('title', '') for result in answer['results'])
+            print(f"{query_id}: answered in {answer['answered_at'] - sent[query_id]:.2f}s [{titles}]")
+        elif query_id in expected:
+            print(f"{query_id}: no answer")
+    
+    server.shutdown()
+    sys.exit(0 if expected <= api.answers.keys() else 1)
+
+if __name__ == '__main__':
+    main()
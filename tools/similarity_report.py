@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Replay logged queries to tune MESSAGE_CACHE_SIMILARITY_THRESHOLD.
+
+Reads successful queries from usage_logs in the order they were made and
+simulates the message cache once per threshold: a query is an exact hit if
+its normalized topic was generated within the TTL, a similar hit if an
+indexed topic is at least that similar, and otherwise a miss that generates
+(and indexes) its topic. Every similar hit is a Gemini call saved.
+
+Reports the hit rates and calls saved per threshold, plus sample matches
+just above each threshold to check for topics that should not have matched.
+Before replaying, checks pairs of topics with opposite meanings that must
+never match at any threshold, and exits with status 1 if one does.
+
+Usage:
+    python3 tools/similarity_report.py --db ./data/bot.db
+    python3 tools/similarity_report.py --db ./data/bot.db --days 30 --thresholds 0.6,0.7,0.8,0.9
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from message_cache import normalize_topic
+from similarity import TopicIndex
+
+# Topics that look alike but say different things: reversed comparisons,
+# negations and version numbers
+MUST_NOT_MATCH = [
+    ("I think TypeScript is better than JavaScript", "I think JavaScript is better than TypeScript"),
+    ("aws vs gcp", "gcp vs aws"),
+    ("tabs over spaces", "spaces over tabs"),
+    ("why ipv6 is great", "why ipv6 is not great"),
+    ("life with coffee", "life without coffee"),
+    ("python 3.12 features", "python 3.11 features"),
+]
+
+def check_must_not_match() -> List[Tuple[float, str, str]]:
+    """Get (score, query, cached topic) of must-not-match pairs that matched."""
+    failures = []
+    for cached, query in MUST_NOT_MATCH:
+        for topic, other in ((cached, query), (query, cached)):
+            index = TopicIndex()
+            index.add(normalize_topic(topic), normalize_topic(topic))
+            match = index.best_match(normalize_topic(other))
+            if match:
+                failures.append((match[1], other, topic))
+    return failures
+
+def load_queries(db_path: str, days: float) -> List[Tuple[int, str]]:
+    """Get (timestamp, query) of successful non-empty queries, oldest first."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('''
+            SELECT timestamp, query FROM usage_logs
+            WHERE timestamp > ? AND success = 1 AND query != ''
+            ORDER BY timestamp
+        ''', (int(time.time() - days * 24 * 60 * 60),)).fetchall()
+    finally:
+        conn.close()
+
+def replay(queries: List[Tuple[int, str]], threshold: float, ttl: float) -> dict:
+    """Simulate the cache at one threshold."""
+    index = TopicIndex()
+    generated_at: Dict[str, int] = {}
+    exact = similar = misses = 0
+    examples = set()
+    lookup_seconds = 0.0
+    
+    for timestamp, query in queries:
+        topic = normalize_topic(query)
+        if timestamp - generated_at.get(topic, -ttl) < ttl:
+            exact += 1
+            continue
+        
+        start = time.perf_counter()
+        match = index.best_match(topic, min_score=threshold)
+        lookup_seconds += time.perf_counter() - start
+        if match and timestamp - generated_at[match[0]] < ttl:
+            similar += 1
+            examples.add((match[1], query, match[0]))
+            continue
+        
+        misses += 1
+        generated_at[topic] = timestamp
+        index.add(topic, topic)
+    
+    lookups = exact + similar + misses
+    return {
+        "threshold": threshold,
+        "exact": exact,
+        "similar": similar,
+        "misses": misses,
+        "exact_rate": exact / lookups if lookups else 0.0,
+        "hit_rate": (exact + similar) / lookups if lookups else 0.0,
+        "avg_lookup_ms": lookup_seconds / max(1, similar + misses) * 1000,
+        # Closest to the threshold first: the likeliest wrong matches
+        "examples": sorted(examples),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', './data/bot.db'))
+    parser.add_argument('--days', type=float, default=7.0, help='how far back to replay')
+    parser.add_argument('--ttl', type=float, default=float(os.getenv('MESSAGE_CACHE_TTL_SECONDS', 86400)),
+                        help='cache TTL in seconds')
+    parser.add_argument('--thresholds', default='0.6,0.7,0.8,0.9,1.0')
+    parser.add_argument('--examples', type=int, default=5, help='sample matches shown per threshold')
+    args = parser.parse_args()
+    
+    failures = check_must_not_match()
+    for score, query, topic in failures:
+        print(f"MUST NOT MATCH  {score:.2f}  {query!r} -> {topic!r}")
+    if failures:
+        sys.exit(1)
+    print(f"All {len(MUST_NOT_MATCH)} must-not-match pairs kept apart")
+    
+    queries = load_queries(args.db, args.days)
+    print(f"Replaying {len(queries)} queries from the last {args.days:g} days (TTL {args.ttl:g}s)")
+    print()
+    print(f"{'threshold':>9}  {'exact':>7}  {'similar':>7}  {'misses':>7}  {'hit rate':>8}  {'calls saved':>11}  {'lookup':>8}")
+    reports = [replay(queries, float(value), args.ttl) for value in args.thresholds.split(',')]
+    for report in reports:
+        saved = report['similar'] / (report['similar'] + report['misses']) if report['similar'] + report['misses'] else 0.0
+        print(
+            f"{report['threshold']:>9.2f}  {report['exact']:>7}  {report['similar']:>7}  {report['misses']:>7}  "
+            f"{report['hit_rate']:>8.1%}  {saved:>11.1%}  {report['avg_lookup_ms']:>6.3f}ms"
+        )
+    
+    for report in reports:
+        if report['examples'] and args.examples:
+            print()
+            print(f"Weakest matches at {report['threshold']:.2f}:")
+            for score, query, topic in report['examples'][:args.examples]:
+                print(f"  {score:.2f}  {query!r} -> {topic!r}")
+
+if __name__ == '__main__':
+    main()